@@ -0,0 +1,107 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Optional, Union
+
+SNAPSHOT_MAGIC = b"FOAPSNAP"
+SNAPSHOT_VERSION = 5
+HEADER_FORMAT = "<8sI32s1sI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SECTION_FORMAT = "<40s1sQQ"
+SECTION_SIZE = struct.calcsize(SECTION_FORMAT)
+ALIGNMENT = 8
+
+# Sections are flat typed arrays ("I" row ids and offsets, "d" coordinates, "B" UTF-8
+# text) keyed by name. On disk they follow a header and a section directory, each
+# aligned so it can be viewed in place: numeric sections as memoryviews cast to their
+# type, text sections as their own page-aligned mmap, which slices straight to bytes.
+Section = Union[array, bytes, memoryview, mmap.mmap]
+Sections = Dict[str, Section]
+
+def default_snapshot_path(csv_file: str) -> str:
+    return os.path.splitext(csv_file)[0] + ".snapshot"
+
+def source_fingerprint(csv_file: str) -> bytes:
+    with open(csv_file, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+def _byte_order() -> bytes:
+    return b"l" if sys.byteorder == "little" else b"b"
+
+def _typecode(section: Section) -> str:
+    return section.format if isinstance(section, memoryview) else getattr(section, "typecode", "B")
+
+def _aligned(offset: int, typecode: str = "d") -> int:
+    alignment = mmap.ALLOCATIONGRANULARITY if typecode == "B" else ALIGNMENT
+    return (offset + alignment - 1) // alignment * alignment
+
+def write_snapshot(snapshot_file: str, csv_file: str, sections: Dict[str, Section]):
+    directory = []
+    offset = _aligned(HEADER_SIZE + SECTION_SIZE * len(sections))
+    for name, section in sections.items():
+        size = memoryview(section).nbytes
+        offset = _aligned(offset, _typecode(section))
+        directory.append(struct.pack(SECTION_FORMAT, name.encode(), _typecode(section).encode(), offset, size))
+        offset += size
+
+    header = struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, source_fingerprint(csv_file),
+                         _byte_order(), len(sections))
+    temp_file = f"{snapshot_file}.{os.getpid()}.tmp"
+    with open(temp_file, "wb") as f:
+        f.write(header)
+        f.write(b"".join(directory))
+        for section in sections.values():
+            f.write(b"\0" * (_aligned(f.tell(), _typecode(section)) - f.tell()))
+            f.write(memoryview(section).cast("B"))
+    os.replace(temp_file, snapshot_file)
+
+# Maps the snapshot read-only and returns zero-copy views of its sections. The pages
+# belong to the OS page cache, so every worker process that maps the same file shares
+# one copy. Returns None when the snapshot is missing, from another format version or
+# byte order, or was built from a different airports.csv, so callers can rebuild it.
+def read_snapshot(snapshot_file: str, csv_file: str) -> Optional[Sections]:
+    try:
+        with open(snapshot_file, "rb") as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                return None
+            magic, version, fingerprint, byte_order, count = struct.unpack(HEADER_FORMAT, header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or byte_order != _byte_order():
+                return None
+            if os.path.exists(csv_file) and fingerprint != source_fingerprint(csv_file):
+                return None
+            region = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            sections: Sections = {}
+            for index in range(count):
+                start = HEADER_SIZE + index * SECTION_SIZE
+                if start + SECTION_SIZE > len(region):
+                    return None
+                name, typecode, offset, size = struct.unpack(SECTION_FORMAT, region[start:start + SECTION_SIZE])
+                if offset + size > len(region):
+                    return None
+                if typecode != b"B":
+                    section = region[offset:offset + size].cast(typecode.decode())
+                elif size:
+                    section = mmap.mmap(f.fileno(), size, offset=offset, access=mmap.ACCESS_READ)
+                else:
+                    section = b""
+                sections[name.rstrip(b"\0").decode()] = section
+            return sections
+    except (OSError, ValueError, struct.error):
+        return None
+
+def build_snapshot(csv_file: str = "airports.csv", snapshot_file: Optional[str] = None) -> str:
+    from backend.iata_lookup import IATALookup
+
+    snapshot_file = snapshot_file or default_snapshot_path(csv_file)
+    lookup = IATALookup(csv_file, snapshot_file=None)
+    write_snapshot(snapshot_file, csv_file, lookup.export_sections())
+    return snapshot_file
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "airports.csv"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"Wrote {build_snapshot(csv_path, output_path)}")
@@ -0,0 +1,418 @@
+import heapq
+import math
+import zlib
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+def _km_to_chord(distance_km: float) -> float:
+    return 2 * math.sin(min(math.pi, distance_km / EARTH_RADIUS_KM) / 2)
+
+def _parse_float(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def _parse_optional(value: str) -> Optional[str]:
+    return None if value in ("", "\\N") else value
+
+# Read-only containers over flat sections (see airport_snapshot). They hold memoryviews
+# into the shared snapshot mapping and decode a value only when it is asked for, so a
+# worker keeps a few dozen small objects instead of one per airport, key and posting.
+class StringColumn(Sequence):
+    __slots__ = ("offsets", "text")
+
+    def __init__(self, offsets: Sequence, text: Sequence):
+        self.offsets = offsets
+        self.text = text
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        offsets = self.offsets
+        if index < 0:
+            index += len(offsets) - 1
+        if not 0 <= index < len(offsets) - 1:
+            raise IndexError(index)
+        return self.text[offsets[index]:offsets[index + 1]].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        text, offsets = self.text, self.offsets
+        for index in range(len(offsets) - 1):
+            yield text[offsets[index]:offsets[index + 1]].decode("utf-8")
+
+    # Position of the first value >= value in a sorted column. UTF-8 byte order is code
+    # point order, so the search compares raw bytes without decoding.
+    def bisect_left(self, value: str) -> int:
+        text, offsets = self.text, self.offsets
+        target = value.encode("utf-8", "surrogatepass")
+        lo, hi = 0, len(offsets) - 1
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if text[offsets[middle]:offsets[middle + 1]] < target:
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+# Variable-length lists of row ids; item i is a zero-copy slice of the flat item array.
+class Postings(Sequence):
+    __slots__ = ("offsets", "items")
+
+    def __init__(self, offsets: Sequence, items: Sequence):
+        self.offsets = offsets
+        self.items = items
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> Sequence:
+        if not 0 <= index < len(self.offsets) - 1:
+            raise IndexError(index)
+        return self.items[self.offsets[index]:self.offsets[index + 1]]
+
+# Builds one record per row from parallel columns, e.g. a NamedTuple per city.
+class Records(Sequence):
+    __slots__ = ("make", "columns")
+
+    def __init__(self, make: Callable[..., Any], *columns: Sequence):
+        self.make = make
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def __getitem__(self, index: int) -> Any:
+        return self.make(*(column[index] for column in self.columns))
+
+EMPTY_SLOT = 0xFFFFFFFF
+
+# String-keyed mapping over a key column, a parallel value column and an open-addressing
+# hash table of key positions. Python's str hash differs per process, so slots are
+# placed by CRC-32 of the UTF-8 key, which every worker computes the same way.
+class HashIndex(Mapping):
+    __slots__ = ("keys_column", "slots", "values_column")
+
+    def __init__(self, keys: StringColumn, slots: Sequence, values: Sequence):
+        self.keys_column = keys
+        self.slots = slots
+        self.values_column = values
+
+    def position(self, key: str) -> int:
+        slots = self.slots
+        text, offsets = self.keys_column.text, self.keys_column.offsets
+        target = key.encode("utf-8", "surrogatepass")
+        mask = len(slots) - 1
+        slot = zlib.crc32(target) & mask
+        while True:
+            position = slots[slot]
+            if position == EMPTY_SLOT:
+                return -1
+            if text[offsets[position]:offsets[position + 1]] == target:
+                return position
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, key: str) -> Any:
+        position = self.position(key) if isinstance(key, str) else -1
+        if position < 0:
+            raise KeyError(key)
+        return self.values_column[position]
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.position(key) >= 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        position = self.position(key) if isinstance(key, str) else -1
+        return self.values_column[position] if position >= 0 else default
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys_column)
+
+    def __len__(self) -> int:
+        return len(self.keys_column)
+
+def pack_strings(sections: Dict[str, Any], name: str, values: Iterable[str]):
+    offsets, chunks = array("I", [0]), []
+    for value in values:
+        chunk = value.encode("utf-8")
+        chunks.append(chunk)
+        offsets.append(offsets[-1] + len(chunk))
+    sections[f"{name}.offsets"] = offsets
+    sections[f"{name}.text"] = b"".join(chunks)
+
+def strings_view(sections: Dict[str, Any], name: str) -> StringColumn:
+    return StringColumn(sections[f"{name}.offsets"], sections[f"{name}.text"])
+
+def pack_postings(sections: Dict[str, Any], name: str, lists: Iterable[Iterable[int]]):
+    offsets, items = array("I", [0]), array("I")
+    for values in lists:
+        items.extend(values)
+        offsets.append(len(items))
+    sections[f"{name}.offsets"] = offsets
+    sections[f"{name}.items"] = items
+
+def postings_view(sections: Dict[str, Any], name: str) -> Postings:
+    return Postings(sections[f"{name}.offsets"], sections[f"{name}.items"])
+
+# Writes the keys of a string-keyed dict in sorted order with their hash slots, at most
+# half full, and returns the values in key order for the caller to pack alongside.
+def pack_index_keys(sections: Dict[str, Any], name: str, mapping: Dict[str, Any]) -> List[Any]:
+    keys = sorted(mapping)
+    pack_strings(sections, f"{name}.keys", keys)
+    size = 1 << max(1, (2 * len(keys)).bit_length())
+    slots = array("I", [EMPTY_SLOT]) * size
+    for position, key in enumerate(keys):
+        slot = zlib.crc32(key.encode("utf-8")) & (size - 1)
+        while slots[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & (size - 1)
+        slots[slot] = position
+    sections[f"{name}.slots"] = slots
+    return [mapping[key] for key in keys]
+
+def index_view(sections: Dict[str, Any], name: str, values: Sequence) -> HashIndex:
+    return HashIndex(strings_view(sections, f"{name}.keys"), sections[f"{name}.slots"], values)
+
+# Column-oriented airport table: one list or typed array per field instead of one dict per
+# airport. Rows are addressed by integer id; row() materialises the public dict shape.
+# A table parsed from the CSV is packed into flat sections once and then served from
+# read-only views of them (from_sections), whether those come from the mapped snapshot
+# or from memory.
+class AirportTable:
+    __slots__ = (
+        "names", "cities", "countries", "iatas", "icaos", "latitudes", "longitudes",
+        "altitudes", "utc_offsets", "timezones", "iata_rows", "spatial"
+    )
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.cities: List[str] = []
+        self.countries: List[str] = []
+        self.iatas: List[str] = []
+        self.icaos: List[str] = []
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.altitudes = array("d")
+        self.utc_offsets = array("d")
+        self.timezones: List[Optional[str]] = []
+        self.iata_rows: Dict[str, int] = {}
+        self.spatial: Optional[SpatialIndex] = None
+
+    STRING_COLUMNS = ("names", "cities", "countries", "iatas", "icaos", "timezones")
+    NUMBER_COLUMNS = ("latitudes", "longitudes", "altitudes", "utc_offsets")
+
+    def __len__(self) -> int:
+        return len(self.iatas)
+
+    def pack(self, sections: Dict[str, Any]):
+        for column in AirportTable.STRING_COLUMNS:
+            pack_strings(sections, f"table.{column}", (value or "" for value in getattr(self, column)))
+        for column in AirportTable.NUMBER_COLUMNS:
+            sections[f"table.{column}"] = getattr(self, column)
+        sections["table.iata_rows"] = array("I", pack_index_keys(sections, "table.iata_rows", self.iata_rows))
+        self.spatial.pack(sections)
+
+    @classmethod
+    def from_sections(cls, sections: Dict[str, Any]) -> "AirportTable":
+        table = cls()
+        for column in AirportTable.STRING_COLUMNS:
+            setattr(table, column, strings_view(sections, f"table.{column}"))
+        for column in AirportTable.NUMBER_COLUMNS:
+            setattr(table, column, sections[f"table.{column}"])
+        table.iata_rows = index_view(sections, "table.iata_rows", sections["table.iata_rows"])
+        table.spatial = SpatialIndex.from_sections(sections)
+        return table
+
+    def append_csv_row(self, row: List[str]) -> int:
+        row_id = len(self.iatas)
+        self.names.append(row[1])
+        self.cities.append(row[2])
+        self.countries.append(row[3])
+        self.iatas.append(row[4])
+        self.icaos.append(row[5])
+        self.latitudes.append(_parse_float(row[6]) if len(row) > 6 else math.nan)
+        self.longitudes.append(_parse_float(row[7]) if len(row) > 7 else math.nan)
+        self.altitudes.append(_parse_float(row[8]) if len(row) > 8 else math.nan)
+        self.utc_offsets.append(_parse_float(row[9]) if len(row) > 9 else math.nan)
+        self.timezones.append(_parse_optional(row[11]) if len(row) > 11 else None)
+        self.iata_rows[row[4]] = row_id
+        return row_id
+
+    def build_spatial_index(self):
+        self.spatial = SpatialIndex(self.latitudes, self.longitudes)
+
+    def row_for_iata(self, iata: str) -> Optional[int]:
+        return self.iata_rows.get(iata)
+
+    def coordinates(self, row_id: int) -> Optional[Tuple[float, float]]:
+        lat, lon = self.latitudes[row_id], self.longitudes[row_id]
+        if math.isnan(lat) or math.isnan(lon):
+            return None
+        return lat, lon
+
+    def row(self, row_id: int) -> Dict:
+        return {
+            "name": self.names[row_id],
+            "city": self.cities[row_id],
+            "country": self.countries[row_id],
+            "iata": self.iatas[row_id],
+            "icao": self.icaos[row_id],
+            "latitude": _optional_number(self.latitudes[row_id]),
+            "longitude": _optional_number(self.longitudes[row_id]),
+            "altitude": _optional_number(self.altitudes[row_id]),
+            "utc_offset": _optional_number(self.utc_offsets[row_id]),
+            "timezone": self.timezones[row_id] or None
+        }
+
+    def distance_km(self, row_a: int, row_b: int) -> Optional[float]:
+        a, b = self.coordinates(row_a), self.coordinates(row_b)
+        if a is None or b is None:
+            return None
+        return haversine_km(a[0], a[1], b[0], b[1])
+
+    def nearest(self, lat: float, lon: float, k: int = 5) -> List[Tuple[int, float]]:
+        return self.spatial.nearest(lat, lon, k) if self.spatial else []
+
+    def within_radius(self, lat: float, lon: float, radius_km: float) -> List[Tuple[int, float]]:
+        return self.spatial.within_radius(lat, lon, radius_km) if self.spatial else []
+
+def _optional_number(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+# Static KD-tree over airport positions as 3-D unit vectors, so distances have no
+# antimeridian or polar special cases. The tree is implicit: `order` holds row ids
+# arranged so every [lo, hi) range is a node whose median element splits on depth % 3.
+class SpatialIndex:
+    __slots__ = ("order", "xs", "ys", "zs")
+
+    def __init__(self, latitudes: array, longitudes: array):
+        self.xs, self.ys, self.zs = array("d"), array("d"), array("d")
+        rows = []
+        for row_id, (lat, lon) in enumerate(zip(latitudes, longitudes)):
+            x, y, z = unit_vector(lat, lon) if not (math.isnan(lat) or math.isnan(lon)) else (math.nan,) * 3
+            self.xs.append(x)
+            self.ys.append(y)
+            self.zs.append(z)
+            if not math.isnan(x):
+                rows.append(row_id)
+        self.order = array("I", self._build(rows, 0))
+
+    def pack(self, sections: Dict[str, Any]):
+        for name in SpatialIndex.__slots__:
+            sections[f"spatial.{name}"] = getattr(self, name)
+
+    @classmethod
+    def from_sections(cls, sections: Dict[str, Any]) -> "SpatialIndex":
+        index = cls.__new__(cls)
+        for name in SpatialIndex.__slots__:
+            setattr(index, name, sections[f"spatial.{name}"])
+        return index
+
+    def _build(self, rows: List[int], depth: int) -> List[int]:
+        if len(rows) <= 1:
+            return rows
+        axis = self._axis(depth)
+        rows.sort(key=axis.__getitem__)
+        middle = len(rows) // 2
+        return self._build(rows[:middle], depth + 1) + [rows[middle]] + self._build(rows[middle + 1:], depth + 1)
+
+    def _axis(self, depth: int) -> array:
+        return (self.xs, self.ys, self.zs)[depth % 3]
+
+    def _search(self, point: Tuple[float, float, float], visit, bound) -> None:
+        stack = [(0, len(self.order), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            middle = (lo + hi) // 2
+            row_id = self.order[middle]
+            dx = self.xs[row_id] - point[0]
+            dy = self.ys[row_id] - point[1]
+            dz = self.zs[row_id] - point[2]
+            visit(row_id, dx * dx + dy * dy + dz * dz)
+            diff = point[depth % 3] - self._axis(depth)[row_id]
+            near, far = ((lo, middle), (middle + 1, hi)) if diff < 0 else ((middle + 1, hi), (lo, middle))
+            if diff * diff <= bound():
+                stack.append((far[0], far[1], depth + 1))
+            stack.append((near[0], near[1], depth + 1))
+
+    def nearest(self, lat: float, lon: float, k: int = 5) -> List[Tuple[int, float]]:
+        if k <= 0:
+            return []
+        point = unit_vector(lat, lon)
+        heap: List[Tuple[float, int]] = []
+
+        def visit(row_id: int, squared: float):
+            if len(heap) < k:
+                heapq.heappush(heap, (-squared, row_id))
+            elif squared < -heap[0][0]:
+                heapq.heapreplace(heap, (-squared, row_id))
+
+        self._search(point, visit, lambda: -heap[0][0] if len(heap) >= k else math.inf)
+        return [(row_id, _chord_to_km(math.sqrt(-squared))) for squared, row_id in sorted(heap, reverse=True)]
+
+    def within_radius(self, lat: float, lon: float, radius_km: float) -> List[Tuple[int, float]]:
+        point = unit_vector(lat, lon)
+        limit = _km_to_chord(radius_km) ** 2
+        found: List[Tuple[float, int]] = []
+
+        def visit(row_id: int, squared: float):
+            if squared <= limit:
+                found.append((squared, row_id))
+
+        self._search(point, visit, lambda: limit)
+        return [(row_id, _chord_to_km(math.sqrt(squared))) for squared, row_id in sorted(found)]
+
+class AirportMapping(Mapping):
+    def __init__(self, table: AirportTable):
+        self.table = table
+
+    def __getitem__(self, iata: str) -> Dict:
+        row_id = self.table.iata_rows.get(iata)
+        if row_id is None:
+            raise KeyError(iata)
+        return self.table.row(row_id)
+
+    def __contains__(self, iata: object) -> bool:
+        return iata in self.table.iata_rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.table.iata_rows)
+
+    def __len__(self) -> int:
+        return len(self.table.iata_rows)
+
+class CityMapping(Mapping):
+    def __init__(self, table: AirportTable, city_rows: Mapping[str, Sequence]):
+        self.table = table
+        self.city_rows = city_rows
+
+    def __getitem__(self, city_key: str) -> List[Dict]:
+        return [self.table.row(row_id) for row_id in self.city_rows[city_key]]
+
+    def __contains__(self, city_key: object) -> bool:
+        return city_key in self.city_rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.city_rows)
+
+    def __len__(self) -> int:
+        return len(self.city_rows)
@@ -1,116 +1,531 @@
+import asyncio
+import bisect
+import heapq
 import itertools
+import logging
+import math
+import random
 import time
 import threading
-from typing import List, Dict, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Tuple, Any, AsyncIterator, NamedTuple, Optional, Set, Union
+import httpx
+import numpy as np
 import requests
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 from backend.iata_lookup import iata_lookup
+from backend.http_client import create_http_session, create_async_http_client
+from backend.price_cache import PriceCache, PriceKey, MemoryPriceCache
+from backend.quota import CallPriority, QuotaExhausted
+from backend.circuit_breaker import CircuitBreaker, backoff_delay, flight_api_breaker, retry_after_seconds
+from backend.metrics import RequestTimings, api_events, api_responses, price_lookups
+from backend.single_flight import SingleFlight, AsyncSingleFlight, price_flights, async_price_flights
 from collections import deque
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Both limiters adapt to throttling (AIMD): a 429 halves the allowed rate and pauses
+# sending for any Retry-After, and each success wins a little of the rate back, up to
+# the configured ceiling.
 class RateLimiter:
-    def __init__(self, max_requests: int = 10, time_window: float = 1.0):
+    def __init__(self, max_requests: int = 10, time_window: float = 1.0, min_requests: int = 1):
         self.max_requests = max_requests
+        self.min_requests = min_requests
         self.time_window = time_window
+        self.limit = float(max_requests)
+        self.paused_until = 0.0
+        self.throttled_at = -math.inf
         self.requests = deque()
         self.lock = threading.Lock()
     
-    def wait_if_needed(self):
+    @property
+    def rate(self) -> float:
+        return self.limit / self.time_window
+    
+    # priority is accepted for interface parity with SharedTokenBucket; a per-process
+    # limiter serves every class alike.
+    def wait_if_needed(self, priority: Union[str, CallPriority] = "interactive"):
+        # Reserve a send slot under the lock and sleep outside it, so concurrent
+        # fetchers queue up for their own slots instead of serialising on the lock.
         with self.lock:
             now = time.time()
             while self.requests and self.requests[0] < now - self.time_window:
                 self.requests.popleft()
             
-            if len(self.requests) >= self.max_requests:
-                sleep_time = self.requests[0] - (now - self.time_window)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                    while self.requests and self.requests[0] < time.time() - self.time_window:
-                        self.requests.popleft()
+            capacity = int(self.limit)
+            if len(self.requests) >= capacity:
+                slot = max(now, self.requests[-capacity] + self.time_window)
+            else:
+                slot = now
+            slot = max(slot, self.paused_until)
             
-            self.requests.append(now)
+            self.requests.append(slot)
+        
+        sleep_time = slot - time.time()
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+    # Gives back the most recent send slot, for a call that was reserved but not sent.
+    def refund(self, priority: Union[str, CallPriority] = "interactive"):
+        with self.lock:
+            if self.requests:
+                self.requests.pop()
+
+    def record_throttle(self, retry_after: Optional[float] = None):
+        with self.lock:
+            now = time.time()
+            if now - self.throttled_at >= self.time_window:
+                self.limit = max(float(self.min_requests), self.limit / 2)
+                self.throttled_at = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.time() + retry_after)
+
+    def record_success(self):
+        with self.lock:
+            self.limit = min(float(self.max_requests), self.limit + 1 / self.limit)
+
+class AsyncRateLimiter:
+    def __init__(self, rate: float = 10.0, burst: int = 10, min_rate: float = 0.5):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.throttled_at = -math.inf
+
+    # Token bucket for the event loop: a caller takes its token up front (possibly going
+    # into debt) and awaits the refill, so nothing ever sleeps while blocking the loop.
+    async def acquire(self, priority: Union[str, CallPriority] = "interactive"):
+        self._refill()
+        self.tokens -= 1
+        
+        if self.tokens < 0:
+            try:
+                await asyncio.sleep(-self.tokens / self.rate)
+            except asyncio.CancelledError:
+                self.tokens += 1
+                raise
+
+    def refund(self, priority: Union[str, CallPriority] = "interactive"):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Tokens that could be spent right now without waiting.
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    # The rate is halved at most once per second however many requests were throttled
+    # together, and a Retry-After becomes token debt, which delays every later acquire.
+    def record_throttle(self, retry_after: Optional[float] = None):
+        self._refill()
+        if self.updated - self.throttled_at >= 1.0:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.throttled_at = self.updated
+        if retry_after:
+            self.tokens = min(self.tokens, -retry_after * self.rate)
+
+    def record_success(self):
+        self._refill()
+        self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+# Lower bound on a leg's fare, per passenger, from the great-circle distance between its
+# airports. The starting values are deliberately loose so the bound stays admissible
+# for budget carriers; with calibration on, every priced leg is observed and once
+# MIN_SAMPLES have arrived the bound is refitted to sit just under all of them.
+class DistancePriceBound:
+    MIN_SAMPLES = 32
+    MAX_SAMPLES = 1000
+    REFIT_EVERY = 32
+
+    def __init__(self, per_km: float = 0.01, floor: float = 0.0, calibrate: bool = True,
+                 safety: float = 0.9):
+        self.per_km = per_km
+        self.floor = floor
+        self.calibrating = calibrate
+        self.safety = safety
+        self.samples: List[Tuple[float, float]] = []
+        self.observed = 0
+        self.fitted = False
+        self.lock = threading.Lock()
+
+    # A bound fitted to observed fares is only admissible for the fares seen so far, so
+    # a search pruned with it can no longer claim its answer is proven optimal.
+    @property
+    def admissible(self) -> bool:
+        return not self.fitted
+
+    @classmethod
+    def calibrate(cls, samples: List[Tuple[float, float]], safety: float = 0.9) -> "DistancePriceBound":
+        fitted = fit_lower_bound(samples, safety)
+        if fitted is None:
+            return cls(calibrate=False)
+        bound = cls(per_km=fitted[0], floor=fitted[1], calibrate=False)
+        bound.fitted = True
+        return bound
+
+    # Records one (distance, per-passenger fare) pair. Samples beyond MAX_SAMPLES
+    # replace random older ones, so the fit follows a changing market.
+    def observe(self, distance_km: float, price: float):
+        if not self.calibrating or distance_km <= 0 or price <= 0:
+            return
+        with self.lock:
+            self.observed += 1
+            if len(self.samples) < self.MAX_SAMPLES:
+                self.samples.append((distance_km, price))
+            else:
+                self.samples[random.randrange(self.MAX_SAMPLES)] = (distance_km, price)
+            if len(self.samples) < self.MIN_SAMPLES or self.observed % self.REFIT_EVERY:
+                return
+            samples = list(self.samples)
+        fitted = fit_lower_bound(samples, self.safety)
+        if fitted is not None:
+            self.per_km, self.floor = fitted
+            self.fitted = True
+
+    def estimate(self, from_iata: str, to_iata: str) -> float:
+        distance = iata_lookup.get_distance_km(from_iata, to_iata)
+        if distance is None:
+            return max(0.0, self.floor)
+        return max(0.0, self.floor + self.per_km * distance)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"per_km": round(self.per_km, 5), "floor": round(self.floor, 2),
+                "samples": len(self.samples), "calibrating": self.calibrating, "admissible": self.admissible}
+
+# Fits floor + per_km * distance under every sample: each candidate slope gets the
+# highest intercept that stays below all points, and the slope whose line is tightest
+# over the samples wins. The result is scaled by `safety` for unseen legs.
+def fit_lower_bound(samples: List[Tuple[float, float]], safety: float = 0.9,
+                    slopes: int = 24) -> Optional[Tuple[float, float]]:
+    points = [(distance, price) for distance, price in samples if distance > 0 and price > 0]
+    if not points:
+        return None
+    max_ratio = max(price / distance for distance, price in points)
+    best = None
+    for step in range(slopes + 1):
+        per_km = max_ratio * step / slopes
+        floor = min(price - per_km * distance for distance, price in points)
+        tightness = sum(max(0.0, floor + per_km * distance) for distance, _ in points)
+        if best is None or tightness > best[0]:
+            best = (tightness, per_km, floor)
+    return best[1] * safety, best[2] * safety
+
+# Advances a search generator one step. StopIteration cannot cross asyncio.to_thread,
+# so completion is returned as (True, result) instead.
+def _resume(search, value: Any) -> Tuple[bool, Any]:
+    try:
+        return False, search.send(value)
+    except StopIteration as done:
+        return True, done.value
+
+class TripPlan(NamedTuple):
+    cities: List[str]
+    middle_cities: List[Dict[str, Any]]
+    start_date: str
+    date_flex: int
+    horizon: Optional[int]
+    queries: Dict[Tuple[int, int, int], Tuple[str, str, str]]
 
 class RouteOptimizer:
-    def __init__(self, adults: int = 1, children: int = 0, infants: int = 0):
+    FAILURE_TTL = 30.0
+    DEFAULT_FARE_PER_KM = 0.1
+    ANYTIME_MAX_POOL = 256
+
+    def __init__(self, adults: int = 1, children: int = 0, infants: int = 0,
+                 session: Optional[requests.Session] = None, max_workers: int = 8,
+                 price_cache: Optional[PriceCache] = None, currency: str = "GBP",
+                 http_client: Optional[httpx.AsyncClient] = None,
+                 async_rate_limiter: Optional[AsyncRateLimiter] = None,
+                 price_bound: Optional[DistancePriceBound] = None,
+                 single_flight: Optional[SingleFlight] = None,
+                 async_single_flight: Optional[AsyncSingleFlight] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None, max_retries: int = 3,
+                 priority: str = "interactive"):
         self.rapidapi_key = os.getenv('RAPIDAPI_KEY')
         self.base_url = "https://google-flights2.p.rapidapi.com"
         self.adults = adults
         self.children = children
         self.infants = infants
-        self.price_cache = {}
-        self.iata_cache = {}
-        self.rate_limiter = RateLimiter(max_requests=10, time_window=1.0)
+        self.currency = currency
+        self.price_cache = price_cache if price_cache is not None else MemoryPriceCache()
+        self.rate_limiter = rate_limiter or RateLimiter(max_requests=10, time_window=1.0)
+        self.session = session or create_http_session(pool_size=max_workers)
+        self.max_workers = max_workers
+        self.http_client = http_client
+        self.async_rate_limiter = async_rate_limiter or AsyncRateLimiter(rate=10.0, burst=10)
+        self.price_bound = price_bound or DistancePriceBound()
+        self.single_flight = single_flight or price_flights
+        self.async_single_flight = async_single_flight or async_price_flights
+        self.circuit_breaker = circuit_breaker or flight_api_breaker
+        self.max_retries = max_retries
+        self.priority = priority
+        self.search_stats: Dict[str, Any] = {}
+        self.timings = RequestTimings()
+        # Earliest expiry (epoch seconds) of any price this optimizer has used, so a
+        # result built from them is cached no longer than its inputs stay valid.
+        self.prices_valid_until = math.inf
+        self.expiry_lock = threading.Lock()
 
     def _get_iata_code(self, city_name: str) -> str:
-        cache_key = city_name.lower()
-        
-        if cache_key in self.iata_cache:
-            return self.iata_cache[cache_key]
-        
         try:
-            iata_code = iata_lookup.get_iata_code(city_name)
-            if iata_code:
-                self.iata_cache[cache_key] = iata_code
-                return iata_code
+            return iata_lookup.get_iata_code(city_name)
         except Exception:
-            pass
+            return city_name[:3].upper()
+
+    def _price_key(self, from_city: str, to_city: str, date: str) -> PriceKey:
+        return PriceKey(
+            from_iata=self._get_iata_code(from_city),
+            to_iata=self._get_iata_code(to_city),
+            date=date,
+            adults=self.adults,
+            children=self.children,
+            infants=self.infants,
+            currency=self.currency
+        )
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "X-RapidAPI-Key": self.rapidapi_key or "",
+            "X-RapidAPI-Host": "google-flights2.p.rapidapi.com"
+        }
+
+    def _search_params(self, key: PriceKey) -> Dict[str, str]:
+        params = {
+            "departure_id": key.from_iata,
+            "arrival_id": key.to_iata,
+            "outbound_date": key.date,
+            "currency": key.currency,
+            "adults": str(key.adults)
+        }
+        
+        if key.children > 0:
+            params["children"] = str(key.children)
+        if key.infants > 0:
+            params["infants"] = str(key.infants)
         
-        fallback_code = city_name[:3].upper()
-        self.iata_cache[cache_key] = fallback_code
-        return fallback_code
+        return params
 
     def _get_flight_price(self, from_city: str, to_city: str, date: str) -> float:
-        cache_key = f"{from_city}_{to_city}_{date}"
-        if cache_key in self.price_cache:
-            return self.price_cache[cache_key]
+        cache_key = self._price_key(from_city, to_city, date)
+        cached_price = self._cached_price(cache_key)
+        if cached_price is not None:
+            return cached_price
         
-        try:
-            self.rate_limiter.wait_if_needed()
-            
-            headers = {
-                "X-RapidAPI-Key": self.rapidapi_key,
-                "X-RapidAPI-Host": "google-flights2.p.rapidapi.com"
-            }
-            
-            from_iata = self._get_iata_code(from_city)
-            to_iata = self._get_iata_code(to_city)
-            
-            params = {
-                "departure_id": from_iata,
-                "arrival_id": to_iata,
-                "outbound_date": date,
-                "currency": "GBP",
-                "adults": str(self.adults)
-            }
-            
-            if self.children > 0:
-                params["children"] = str(self.children)
-            if self.infants > 0:
-                params["infants"] = str(self.infants)
-            
-            response = requests.get(
-                f"{self.base_url}/api/v1/searchFlights",
-                headers=headers,
-                params=params,
-                timeout=15
-            )
+        priority = CallPriority(self.priority)
+        return self._note_fetched(self.single_flight.do(
+            cache_key, lambda: self._fetch_flight_price(cache_key, priority), priority))
+
+    def _cached_price(self, cache_key: PriceKey) -> Optional[float]:
+        entry = self.price_cache.lookup(cache_key)
+        self._record_lookup(entry is not None)
+        if entry is None:
+            return None
+        self._note_expiry(entry.expires_at)
+        self._observe_fare(cache_key, entry.price)
+        return entry.price
+
+    # Feeds priced legs to the distance bound as per-passenger fares, which keeps it
+    # admissible for any party size.
+    def _observe_fare(self, cache_key: PriceKey, price: float):
+        if price > 0 and self.price_bound.calibrating:
+            distance = iata_lookup.get_distance_km(cache_key.from_iata, cache_key.to_iata)
+            if distance:
+                passengers = max(1, cache_key.adults + cache_key.children + cache_key.infants)
+                self.price_bound.observe(distance, price / passengers)
+
+    # A fetched price stays valid for the cache TTL. A zero (no flights, a failed or
+    # coalesced fetch that gave up, an open circuit) is treated as short-lived.
+    def _note_fetched(self, price: float) -> float:
+        ttl = self.price_cache.ttl if price > 0 else min(self.FAILURE_TTL, self.price_cache.negative_ttl)
+        self._note_expiry(time.time() + ttl)
+        return price
+
+    def _note_expiry(self, expires_at: float):
+        with self.expiry_lock:
+            self.prices_valid_until = min(self.prices_valid_until, expires_at)
+
+    # Retryable answers (429, 5xx, transport errors) are retried with jittered
+    # exponential backoff that honours Retry-After. A leg that keeps failing is
+    # negatively cached for FAILURE_TTL; while the circuit is open calls fail fast.
+    def _fetch_flight_price(self, cache_key: PriceKey, priority: CallPriority) -> float:
+        retry_after = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._record_event("retry")
+                time.sleep(backoff_delay(attempt - 1, retry_after))
+            if self.circuit_breaker.is_open():
+                self._record_event("circuit_open")
+                return 0.0
+            try:
+                with self.timings.phase("rate_limit_wait"):
+                    self.rate_limiter.wait_if_needed(priority)
+            except QuotaExhausted:
+                self._record_event("quota_exhausted")
+                return 0.0
             
-            if response.status_code == 200:
-                data = response.json()
-                price = self._extract_price_from_response(data)
-                if price is not None and price > 0:
-                    self.price_cache[cache_key] = price
-                    return price
-            elif response.status_code == 429:
-                time.sleep(2)
+            with self.circuit_breaker.call() as allowed:
+                if not allowed:
+                    # Another caller claimed the probe while this one waited for its token.
+                    self.rate_limiter.refund(priority)
+                    self._record_event("circuit_open")
+                    return 0.0
+                try:
+                    with self.timings.phase("http"):
+                        response = self.session.get(
+                            f"{self.base_url}/api/v1/searchFlights",
+                            headers=self._headers(),
+                            params=self._search_params(cache_key),
+                            timeout=15
+                        )
+                    
+                    price = self._price_from_response(cache_key, response, self.rate_limiter)
+                except Exception as e:
+                    self._record_failure(cache_key, e)
+                    retry_after = None
+                    continue
             
+            if price is not None:
+                return price
+            retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        
+        return self._give_up(cache_key)
+
+    # Returns the leg price, 0.0 for a final "no price" answer, or None when the
+    # request should be retried.
+    def _price_from_response(self, cache_key: PriceKey, response: Any, limiter: Any) -> Optional[float]:
+        status = response.status_code
+        api_responses.inc(status=str(status))
+        self.timings.count(f"http_{status}")
+        
+        if status >= 500:
+            self.circuit_breaker.record_failure()
+            self._record_event("server_error")
+            return None
+        
+        self.circuit_breaker.record_success()
+        if status == 429:
+            self._record_event("rate_limited")
+            limiter.record_throttle(retry_after_seconds(response.headers.get("Retry-After")))
+            return None
+        
+        limiter.record_success()
+        if status != 200:
+            self._record_event("client_error")
             return 0.0
+        
+        with self.timings.phase("parse"):
+            price = self._extract_price_from_response(response.json())
+        if price is not None and price > 0:
+            self.price_cache.set(cache_key, price)
+            self._observe_fare(cache_key, price)
+            return price
+        
+        self._record_event("null_price")
+        self.price_cache.set_negative(cache_key)
+        return 0.0
+
+    def _record_failure(self, cache_key: PriceKey, error: Exception):
+        self.circuit_breaker.record_failure()
+        self._record_event("error")
+        logger.debug(f"Flight price fetch failed for {cache_key}: {error}")
+
+    def _give_up(self, cache_key: PriceKey) -> float:
+        self._record_event("gave_up")
+        self.price_cache.set_negative(cache_key, ttl=min(self.FAILURE_TTL, self.price_cache.negative_ttl))
+        return 0.0
+
+    def _record_event(self, event: str):
+        self.timings.count(event)
+        api_events.inc(event=event)
+
+    def _record_lookup(self, hit: bool):
+        self.timings.count("cache_hits" if hit else "cache_misses")
+        price_lookups.inc(result="hit" if hit else "miss")
+
+    async def _get_flight_price_async(self, from_city: str, to_city: str, date: str) -> float:
+        return await self.get_price_async(self._price_key(from_city, to_city, date))
+
+    async def get_price_async(self, cache_key: PriceKey) -> float:
+        cached_price = await self._off_loop(self._cached_price, cache_key)
+        if cached_price is not None:
+            return cached_price
+        
+        return self._note_fetched(await self._shared_fetch_async(cache_key))
+
+    # Fetches a price even if it is cached, e.g. to refresh an entry before it expires.
+    async def refresh_price_async(self, cache_key: PriceKey) -> float:
+        return await self._shared_fetch_async(cache_key)
+
+    # Requests that join an in-flight fetch raise its priority to their own, so the
+    # fetch never waits at a lower class than the most urgent caller.
+    async def _shared_fetch_async(self, cache_key: PriceKey) -> float:
+        priority = CallPriority(self.priority)
+        return await self.async_single_flight.do(
+            cache_key, lambda: self._fetch_flight_price_async(cache_key, priority), priority)
+
+    async def _fetch_flight_price_async(self, cache_key: PriceKey, priority: CallPriority) -> float:
+        if self.http_client is None:
+            self.http_client = create_async_http_client(max_connections=self.max_workers)
+        
+        retry_after = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._record_event("retry")
+                await asyncio.sleep(backoff_delay(attempt - 1, retry_after))
+            if self.circuit_breaker.is_open():
+                self._record_event("circuit_open")
+                return 0.0
+            try:
+                with self.timings.phase("rate_limit_wait"):
+                    await self.async_rate_limiter.acquire(priority)
+            except QuotaExhausted:
+                self._record_event("quota_exhausted")
+                return 0.0
             
-        except Exception:
-            return 0.0
+            with self.circuit_breaker.call() as allowed:
+                if not allowed:
+                    self.async_rate_limiter.refund(priority)
+                    self._record_event("circuit_open")
+                    return 0.0
+                try:
+                    with self.timings.phase("http"):
+                        response = await self.http_client.get(
+                            f"{self.base_url}/api/v1/searchFlights",
+                            headers=self._headers(),
+                            params=self._search_params(cache_key),
+                            timeout=15
+                        )
+                    
+                    price = await self._off_loop(self._price_from_response, cache_key, response,
+                                                 self.async_rate_limiter)
+                except Exception as e:
+                    self._record_failure(cache_key, e)
+                    retry_after = None
+                    continue
+            
+            if price is not None:
+                return price
+            retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        
+        return await self._off_loop(self._give_up, cache_key)
+
+    # Runs a price cache access from the async paths, in a thread if the cache can block.
+    async def _off_loop(self, fn, *args):
+        if self.price_cache.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
 
     def _extract_price_from_response(self, data: Any) -> float:
         try:
@@ -168,10 +583,216 @@ class RouteOptimizer:
 
     def find_optimal_routes(self, start_city: str, end_city: str, 
                           middle_cities: List[Dict[str, Any]], 
-                          start_date: str, end_date: str, num_results: int = 3) -> List[Dict]:
+                          start_date: str, end_date: str, num_results: int = 3,
+                          engine: str = "dp", date_flex: int = 0,
+                          deadline_ms: Optional[int] = None) -> List[Dict]:
         if not start_city or not end_city:
             return []
+        if deadline_ms and date_flex > 0:
+            raise ValueError("deadline_ms is not supported together with date_flex")
+        
+        if deadline_ms:
+            deadline = time.monotonic() + deadline_ms / 1000
+            plan = self.plan_trip(start_city, end_city, middle_cities, start_date, end_date)
+            search = self._anytime_search(plan, num_results, deadline)
+            try:
+                queries = next(search)
+                while True:
+                    queries = search.send(self.prefetch_prices(queries, timeout=self._fetch_budget(deadline)))
+            except StopIteration as done:
+                return done.value[:num_results]
+        
+        if date_flex > 0:
+            return self._plan_and_solve(start_city, end_city, middle_cities, start_date, end_date,
+                                        num_results, date_flex)
+        
+        if engine == "permutations":
+            all_routes = self._find_routes_by_permutation(start_city, end_city, middle_cities, start_date)
+        elif engine == "bnb":
+            search = self._branch_and_bound(start_city, end_city, middle_cities, start_date, num_results)
+            try:
+                queries = next(search)
+                while True:
+                    queries = search.send(self.prefetch_prices(queries))
+            except StopIteration as done:
+                all_routes = done.value
+        else:
+            return self._plan_and_solve(start_city, end_city, middle_cities, start_date, end_date, num_results)
+        
+        if not all_routes:
+            return []
+        
+        all_routes.sort(key=lambda x: x['total_cost'])
+        
+        return all_routes[:num_results]
+
+    async def find_optimal_routes_async(self, start_city: str, end_city: str,
+                                        middle_cities: List[Dict[str, Any]],
+                                        start_date: str, end_date: str, num_results: int = 3,
+                                        engine: str = "dp", date_flex: int = 0,
+                                        deadline_ms: Optional[int] = None) -> List[Dict]:
+        if not start_city or not end_city:
+            return []
+        if deadline_ms and date_flex > 0:
+            raise ValueError("deadline_ms is not supported together with date_flex")
+        
+        if deadline_ms:
+            deadline = time.monotonic() + deadline_ms / 1000
+            plan = self.plan_trip(start_city, end_city, middle_cities, start_date, end_date)
+            search = self._anytime_search(plan, num_results, deadline)
+            finished, result = await asyncio.to_thread(_resume, search, None)
+            while not finished:
+                fetched = await self.prefetch_prices_async(result, timeout=self._fetch_budget(deadline))
+                finished, result = await asyncio.to_thread(_resume, search, fetched)
+            return result[:num_results]
+        
+        if date_flex > 0:
+            return await self._plan_and_solve_async(start_city, end_city, middle_cities, start_date,
+                                                    end_date, num_results, date_flex)
         
+        if engine == "permutations":
+            return await asyncio.to_thread(self.find_optimal_routes, start_city, end_city, middle_cities,
+                                           start_date, end_date, num_results, engine)
+        
+        if engine == "bnb":
+            search = self._branch_and_bound(start_city, end_city, middle_cities, start_date, num_results)
+            try:
+                queries = next(search)
+                while True:
+                    queries = search.send(await self.prefetch_prices_async(queries))
+            except StopIteration as done:
+                return done.value[:num_results]
+        
+        return await self._plan_and_solve_async(start_city, end_city, middle_cities, start_date,
+                                                end_date, num_results)
+
+    def _plan_and_solve(self, start_city: str, end_city: str, middle_cities: List[Dict[str, Any]],
+                        start_date: str, end_date: str, num_results: int, date_flex: int = 0) -> List[Dict]:
+        plan = self.plan_trip(start_city, end_city, middle_cities, start_date, end_date, date_flex)
+        fetched = self.prefetch_prices(set(plan.queries.values()))
+        prices = {leg: fetched[query] for leg, query in plan.queries.items()}
+        return self.solve_trip(plan, prices, num_results)[:num_results]
+
+    async def _plan_and_solve_async(self, start_city: str, end_city: str,
+                                    middle_cities: List[Dict[str, Any]], start_date: str, end_date: str,
+                                    num_results: int, date_flex: int = 0) -> List[Dict]:
+        plan = self.plan_trip(start_city, end_city, middle_cities, start_date, end_date, date_flex)
+        fetched = await self.prefetch_prices_async(set(plan.queries.values()))
+        prices = {leg: fetched[query] for leg, query in plan.queries.items()}
+        all_routes = await asyncio.to_thread(self.solve_trip, plan, prices, num_results)
+        return all_routes[:num_results]
+
+    # A trip's legs and their (from, to, date) queries, planned but not yet priced, so
+    # callers such as the batch endpoint can fetch the legs of many trips together.
+    def plan_trip(self, start_city: str, end_city: str, middle_cities: List[Dict[str, Any]],
+                  start_date: str, end_date: str, date_flex: int = 0) -> TripPlan:
+        horizon = self._flex_horizon(middle_cities, start_date, end_date, date_flex) if date_flex > 0 else None
+        cities = [city['name'] for city in middle_cities] + [start_city, end_city]
+        legs = self._plan_legs(middle_cities, date_flex, horizon)
+        queries = self._leg_queries(cities, legs, start_date)
+        return TripPlan(cities, middle_cities, start_date, date_flex, horizon, queries)
+
+    def price_keys(self, plan: TripPlan) -> Dict[Tuple[int, int, int], PriceKey]:
+        return {leg: self._price_key(*query) for leg, query in plan.queries.items()}
+
+    # Solves a planned trip against its leg prices and records search_stats; legs_priced
+    # defaults to every planned leg, and legs missing from `prices` count as no flights.
+    # Searches that only price some legs pass their own engine name and whether the
+    # answer is still proven optimal.
+    def solve_trip(self, plan: TripPlan, prices: Dict[Tuple[int, int, int], float],
+                   num_results: int, legs_priced: Optional[int] = None,
+                   engine: Optional[str] = None, proven_optimal: bool = True) -> List[Dict]:
+        legs_planned = len(set(plan.queries.values()))
+        self._record_search_stats(engine or ("flex" if plan.date_flex > 0 else "dp"), legs_planned,
+                                  legs_planned if legs_priced is None else legs_priced, proven_optimal)
+        with self.timings.phase("solve"):
+            if plan.date_flex > 0:
+                return self._solve_flexible_dates(plan.cities, plan.middle_cities, prices, plan.start_date,
+                                                  plan.date_flex, plan.horizon, num_results)
+            return self._solve_subset_dp(plan.cities, plan.middle_cities, prices, plan.start_date, num_results)
+
+    # Streams the DP search as events: the plan size, fetch progress, an updated top-k
+    # whenever the routes that are already fully priced improve, and the final result.
+    # It solves the same plan_trip() plan as /optimize with solve_trip(), re-run over
+    # the prices fetched so far. The legs of the as-entered route are fetched first so
+    # an answer appears early. Closing the generator cancels every fetch still outstanding.
+    async def stream_optimal_routes(self, start_city: str, end_city: str,
+                                    middle_cities: List[Dict[str, Any]],
+                                    start_date: str, end_date: str, num_results: int = 3,
+                                    date_flex: int = 0, timeout: Optional[float] = None,
+                                    progress_interval: float = 0.5) -> AsyncIterator[Dict[str, Any]]:
+        if not start_city or not end_city:
+            yield {"type": "result", "status": "success", "count": 0, "routes": []}
+            return
+        
+        plan = self.plan_trip(start_city, end_city, middle_cities, start_date, end_date, date_flex)
+        ordered = self._leg_fetch_order(plan)
+        
+        def solve(fetched: Dict[Tuple[str, str, str], float]) -> List[Dict]:
+            prices = {leg: fetched[query] for leg, query in plan.queries.items() if query in fetched}
+            return self.solve_trip(plan, prices, num_results, legs_priced=len(fetched))
+        
+        async def fetch(query: Tuple[str, str, str]) -> Tuple[Tuple[str, str, str], float]:
+            return query, await self._get_flight_price_async(*query)
+        
+        yield {"type": "plan", "legs_planned": len(ordered)}
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        pending = {asyncio.ensure_future(fetch(query)) for query in ordered}
+        fetched: Dict[Tuple[str, str, str], float] = {}
+        best_seen = None
+        
+        try:
+            while pending:
+                wait_time = progress_interval
+                if deadline is not None:
+                    wait_time = min(wait_time, deadline - loop.time())
+                    if wait_time <= 0:
+                        yield {"type": "error", "detail": "Optimization timed out",
+                               "legs_fetched": len(fetched), "legs_planned": len(ordered)}
+                        return
+                
+                done, pending = await asyncio.wait(pending, timeout=wait_time)
+                if not done:
+                    continue
+                for task in done:
+                    query, price = task.result()
+                    fetched[query] = price
+                
+                yield {"type": "progress", "legs_fetched": len(fetched), "legs_planned": len(ordered)}
+                
+                if pending:
+                    routes = await asyncio.to_thread(solve, dict(fetched))
+                    summary = [(route['route'], route['flight_dates'], route['total_cost']) for route in routes]
+                    if routes and summary != best_seen:
+                        best_seen = summary
+                        yield {"type": "routes", "routes": routes, "legs_fetched": len(fetched),
+                               "legs_planned": len(ordered)}
+            
+            routes = await asyncio.to_thread(solve, fetched)
+            yield {"type": "result", "status": "success", "count": len(routes), "routes": routes,
+                   "search_stats": self.search_stats}
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _leg_fetch_order(self, plan: TripPlan) -> List[Tuple[str, str, str]]:
+        middle_cities, queries = plan.middle_cities, plan.queries
+        n = len(middle_cities)
+        stops = [n] + list(range(n)) + [n + 1]
+        offset = 0
+        first = []
+        for position in range(len(stops) - 1):
+            if position > 0:
+                offset += middle_cities[stops[position]]['days']
+            leg = (stops[position], stops[position + 1], offset)
+            if leg in queries:
+                first.append(queries[leg])
+        return list(dict.fromkeys(first + list(queries.values())))
+
+    def _find_routes_by_permutation(self, start_city: str, end_city: str,
+                                    middle_cities: List[Dict[str, Any]], start_date: str) -> List[Dict]:
         all_routes = []
         
         for perm in itertools.permutations(range(len(middle_cities))):
@@ -181,24 +802,586 @@ class RouteOptimizer:
             total_cost, individual_prices, flight_dates = self._calculate_route_cost_with_dates_and_prices(route_cities, route_days, start_date)
             
             if total_cost > 0 and all(price > 0 for price in individual_prices):
-                all_routes.append({
-                    'route': route_cities,
-                    'days_per_city': route_days,
-                    'total_cost': total_cost,
-                    'individual_prices': individual_prices,
-                    'flight_dates': flight_dates,
-                    'num_flights': len(route_cities) - 1,
-                    'start_city': start_city,
-                    'end_city': end_city,
-                    'total_days': sum(route_days)
-                })
+                all_routes.append(self._build_route(route_cities, route_days, total_cost, individual_prices, flight_dates))
         
-        if not all_routes:
+        return all_routes
+
+    def _build_route(self, route_cities: List[str], route_days: List[int], total_cost: float,
+                     individual_prices: List[float], flight_dates: List[str]) -> Dict:
+        return {
+            'route': route_cities,
+            'days_per_city': route_days,
+            'total_cost': total_cost,
+            'individual_prices': individual_prices,
+            'flight_dates': flight_dates,
+            'num_flights': len(route_cities) - 1,
+            'start_city': route_cities[0],
+            'end_city': route_cities[-1],
+            'total_days': sum(route_days)
+        }
+
+    # A leg leaves a city on start_date plus the days spent in every city visited so far,
+    # so its date depends only on the visited set, never on the order. Legs are therefore
+    # planned as (from index, to index, day offset); the start city is index n and the end
+    # city index n + 1. With date_flex each stay may take any length in its flex window,
+    # and legs that could not arrive by `horizon` days are left out.
+    def _plan_legs(self, middle_cities: List[Dict[str, Any]], date_flex: int = 0,
+                   horizon: Optional[int] = None) -> List[Tuple[int, int, int]]:
+        with self.timings.phase("plan"):
+            return self._enumerate_legs(middle_cities, date_flex, horizon)
+
+    def _enumerate_legs(self, middle_cities: List[Dict[str, Any]], date_flex: int = 0,
+                        horizon: Optional[int] = None) -> List[Tuple[int, int, int]]:
+        n = len(middle_cities)
+        stays = self._stay_options(middle_cities, date_flex)
+        start, end = n, n + 1
+        
+        if n == 0:
+            return [(start, end, 0)]
+        
+        def fits(offset: int, to_index: int) -> bool:
+            return horizon is None or offset + (min(stays[to_index]) if to_index < n else 0) <= horizon
+        
+        legs = [(start, j, 0) for j in range(n) if fits(0, j)]
+        totals = {0}
+        for options in stays:
+            totals = {total + stay for total in totals for stay in options}
+        legs.extend((i, end, total) for i in range(n) for total in sorted(totals) if fits(total, end))
+        
+        for i in range(n):
+            for j in range(n):
+                if i == j:
+                    continue
+                offsets = {0}
+                for k in range(n):
+                    if k != i and k != j:
+                        offsets |= {offset + stay for offset in offsets for stay in stays[k]}
+                departures = {stay + offset for stay in stays[i] for offset in offsets}
+                legs.extend((i, j, departure) for departure in sorted(departures) if fits(departure, j))
+        
+        return legs
+
+    def _stay_options(self, middle_cities: List[Dict[str, Any]], date_flex: int = 0) -> List[List[int]]:
+        if date_flex <= 0:
+            return [[city['days']] for city in middle_cities]
+        return [list(range(max(1, city['days'] - date_flex), city['days'] + date_flex + 1))
+                for city in middle_cities]
+
+    def _leg_queries(self, cities: List[str], legs: List[Tuple[int, int, int]],
+                     start_date: str) -> Dict[Tuple[int, int, int], Tuple[str, str, str]]:
+        base_date = datetime.strptime(start_date, "%Y-%m-%d")
+        queries = {}
+        for leg in legs:
+            from_index, to_index, offset = leg
+            date_str = (base_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+            queries[leg] = (cities[from_index], cities[to_index], date_str)
+        return queries
+
+    # With a timeout, only the prices that arrived in time are returned; fetches still
+    # running keep going in the background and land in the price cache.
+    def prefetch_prices(self, queries: Set[Tuple[str, str, str]],
+                        timeout: Optional[float] = None) -> Dict[Tuple[str, str, str], float]:
+        queries = list(queries)
+        with self.timings.phase("fetch"):
+            if timeout is not None:
+                executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(queries))))
+                futures = {executor.submit(self._get_flight_price, *query): query for query in queries}
+                done, _ = wait(futures, timeout=max(0.0, timeout))
+                executor.shutdown(wait=False, cancel_futures=True)
+                return {futures[future]: future.result() for future in done}
+            if len(queries) > 1 and self.max_workers > 1:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(queries))) as executor:
+                    prices = list(executor.map(lambda query: self._get_flight_price(*query), queries))
+            else:
+                prices = [self._get_flight_price(*query) for query in queries]
+        
+        return dict(zip(queries, prices))
+
+    async def prefetch_prices_async(self, queries: Set[Tuple[str, str, str]],
+                                    timeout: Optional[float] = None) -> Dict[Tuple[str, str, str], float]:
+        queries = list(queries)
+        with self.timings.phase("fetch"):
+            if timeout is not None:
+                tasks = {asyncio.ensure_future(self._get_flight_price_async(*query)): query for query in queries}
+                if not tasks:
+                    return {}
+                done, pending = await asyncio.wait(tasks, timeout=max(0.0, timeout))
+                for task in pending:
+                    task.cancel()
+                return {tasks[task]: task.result() for task in done}
+            prices = await asyncio.gather(*(self._get_flight_price_async(*query) for query in queries))
+        return dict(zip(queries, prices))
+
+    def _record_search_stats(self, engine: str, legs_planned: int, legs_priced: int,
+                             proven_optimal: bool = True):
+        self.search_stats = {
+            "engine": engine,
+            "legs_planned": legs_planned,
+            "legs_priced": legs_priced,
+            "api_calls_saved": max(legs_planned - legs_priced, 0),
+            "proven_optimal": proven_optimal
+        }
+
+    def _leg_bounds(self, cities: List[str]) -> List[List[float]]:
+        codes = [self._get_iata_code(city) for city in cities]
+        return [[self.price_bound.estimate(from_code, to_code) for to_code in codes] for from_code in codes]
+
+    # Admissible estimate of the cost still to come: every unvisited city, and the end
+    # city, must be entered exactly once, so sum the cheapest bound into each of them.
+    def _remaining_bound(self, bounds: List[List[float]], n: int, mask: int, last: int) -> float:
+        remaining = [city for city in range(n) if not mask & (1 << city)]
+        total = min(bounds[city][n + 1] for city in remaining) if remaining else bounds[last][n + 1]
+        for city in remaining:
+            total += min(bounds[previous][city] for previous in [last] + remaining if previous != city)
+        return total
+
+    # Best-first search over partial routes. A new leg enters the queue priced at its
+    # distance bound; its real fare is only fetched when that entry reaches the front,
+    # so subtrees whose bound already exceeds the k-th best route never cost an API
+    # call. This is a generator: it yields sets of leg queries and is sent back their
+    # prices, so the same search runs behind the threaded and the asyncio fetchers.
+    def _branch_and_bound(self, start_city: str, end_city: str, middle_cities: List[Dict[str, Any]],
+                          start_date: str, num_results: int):
+        n = len(middle_cities)
+        days = [city['days'] for city in middle_cities]
+        cities = [city['name'] for city in middle_cities] + [start_city, end_city]
+        start, end = n, n + 1
+        full = (1 << n) - 1
+        k = max(num_results, 1)
+        base_date = datetime.strptime(start_date, "%Y-%m-%d")
+        bounds = self._leg_bounds(cities)
+        
+        prices: Dict[Tuple[int, int, int], float] = {}
+        queries_priced: Set[Tuple[str, str, str]] = set()
+        settled: Dict[Tuple[int, int], int] = {}
+        heap: List[tuple] = []
+        counter = itertools.count()
+        
+        def leg_query(leg: Tuple[int, int, int]) -> Tuple[str, str, str]:
+            from_index, to_index, offset = leg
+            return (cities[from_index], cities[to_index],
+                    (base_date + timedelta(days=offset)).strftime("%Y-%m-%d"))
+        
+        # Nodes are (bound, seq, cost, mask, last, offset, parent, pending_leg); cost
+        # includes pending_leg at its estimate until the real fare replaces it.
+        def push(cost: float, mask: int, last: int, offset: int, parent: Optional[tuple],
+                 pending: Optional[Tuple[int, int, int]]):
+            remaining = 0.0 if last == end else self._remaining_bound(bounds, n, mask, last)
+            heapq.heappush(heap, (cost + remaining, next(counter), cost, mask, last, offset, parent, pending))
+        
+        def expand(node: tuple):
+            _, _, cost, mask, last, offset, _, _ = node
+            targets = [end] if mask == full else [city for city in range(n) if not mask & (1 << city)]
+            for target in targets:
+                leg = (last, target, offset)
+                child_mask = mask if target == end else mask | (1 << target)
+                child_offset = offset if target == end else offset + days[target]
+                if leg in prices:
+                    if prices[leg] > 0:
+                        push(cost + prices[leg], child_mask, target, child_offset, node, None)
+                else:
+                    push(cost + bounds[last][target], child_mask, target, child_offset, node, leg)
+        
+        expand((0.0, -1, 0.0, 0, start, 0, None, None))
+        finished = []
+        
+        while heap and len(finished) < k:
+            node = heapq.heappop(heap)
+            
+            if node[7] is not None:
+                batch = [node]
+                while heap and heap[0][7] is not None and len(batch) < self.max_workers:
+                    batch.append(heapq.heappop(heap))
+                
+                wanted = {leg_query(entry[7]) for entry in batch if entry[7] not in prices}
+                if wanted:
+                    fetched = yield wanted
+                    queries_priced |= wanted
+                    for entry in batch:
+                        if entry[7] not in prices:
+                            prices[entry[7]] = fetched[leg_query(entry[7])]
+                
+                for _, _, cost, mask, last, offset, parent, leg in batch:
+                    price = prices[leg]
+                    if price > 0:
+                        push(cost - bounds[leg[0]][leg[1]] + price, mask, last, offset, parent, None)
+                continue
+            
+            if node[4] == end:
+                finished.append(node)
+                continue
+            
+            state = (node[3], node[4])
+            if settled.get(state, 0) >= k:
+                continue
+            settled[state] = settled.get(state, 0) + 1
+            expand(node)
+        
+        legs = self._plan_legs(middle_cities)
+        planned = len(set(self._leg_queries(cities, legs, start_date).values()))
+        self._record_search_stats("bnb", planned, len(queries_priced), proven_optimal=self.price_bound.admissible)
+        
+        routes = []
+        for node in finished:
+            order = []
+            parent = node[6]
+            while parent is not None and parent[4] != start:
+                order.append(parent[4])
+                parent = parent[6]
+            order.reverse()
+            routes.append(self._route_from_path(order, cities, days, prices, start_date))
+        return routes
+
+    # Anytime search for trips too large to price exhaustively before a deadline. Local
+    # search (greedy start, 2-opt and or-opt moves, random restarts) runs over the prices
+    # known so far, with distance-based estimates for the rest; the legs of its best
+    # tours are then priced for real and the search repeats until those tours are fully
+    # priced or time runs out. The answer is the exact DP over every priced leg, so it is
+    # proven optimal only if every planned leg got priced. Like _branch_and_bound this is
+    # a generator that yields leg queries and is sent back whatever prices arrived.
+    def _anytime_search(self, plan: TripPlan, num_results: int, deadline: float):
+        n = len(plan.middle_cities)
+        days = [city['days'] for city in plan.middle_cities]
+        known: Dict[Tuple[int, int, int], float] = {}
+        for leg, query in plan.queries.items():
+            entry = self.price_cache.lookup(self._price_key(*query))
+            if entry is not None:
+                self._note_expiry(entry.expires_at)
+                known[leg] = entry.price
+        
+        rng = random.Random(0)
+        pool_size = max(2 * num_results, 4)
+        while len(known) < len(plan.queries):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            estimates = self._leg_estimates(plan.cities, known)
+            
+            def leg_price(leg: Tuple[int, int, int]) -> float:
+                price = known.get(leg)
+                if price is None:
+                    return estimates[leg[0]][leg[1]]
+                return price if price > 0 else math.inf
+            
+            with self.timings.phase("solve"):
+                tours = self._local_search(n, days, leg_price, min(remaining * 0.25, 0.5), rng, pool_size)
+            wanted = {leg for tour in tours for leg in self._tour_legs(tour, days, n) if leg not in known}
+            if not wanted:
+                # The best tours are all priced: widen the pool to keep exploring, and
+                # once it is at its cap spend what time is left pricing every remaining
+                # leg, which makes the DP answer provably optimal if they all arrive.
+                if pool_size < self.ANYTIME_MAX_POOL:
+                    pool_size *= 2
+                    continue
+                wanted = set(plan.queries) - set(known)
+            
+            fetched = yield {plan.queries[leg] for leg in wanted}
+            arrived = {leg: fetched[plan.queries[leg]] for leg in wanted if plan.queries[leg] in fetched}
+            if not arrived:
+                break
+            known.update(arrived)
+        
+        priced = len({plan.queries[leg] for leg in known})
+        return self.solve_trip(plan, known, num_results, legs_priced=priced, engine="anytime",
+                               proven_optimal=len(known) == len(plan.queries))
+
+    # Fetching stops a little before the deadline, leaving time to solve over the
+    # prices that arrived.
+    def _fetch_budget(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        return max(0.0, remaining - min(0.2, remaining * 0.1))
+
+    def _tour_legs(self, tour: Tuple[int, ...], days: List[int], n: int) -> List[Tuple[int, int, int]]:
+        legs = []
+        previous, offset = n, 0
+        for city in tour:
+            legs.append((previous, city, offset))
+            offset += days[city]
+            previous = city
+        legs.append((previous, n + 1, offset))
+        return legs
+
+    # Fare guesses for unpriced legs: great-circle distance times a low quantile of the
+    # fare per km of the legs already priced (or a default rate), never below the
+    # admissible bound. Leaning optimistic keeps unpriced tours worth exploring.
+    def _leg_estimates(self, cities: List[str], known: Dict[Tuple[int, int, int], float]) -> List[List[float]]:
+        codes = [self._get_iata_code(city) for city in cities]
+        distances = [[iata_lookup.get_distance_km(a, b) for b in codes] for a in codes]
+        ratios = sorted(price / distances[leg[0]][leg[1]] for leg, price in known.items()
+                        if price > 0 and distances[leg[0]][leg[1]])
+        per_km = ratios[len(ratios) // 4] if ratios else self.DEFAULT_FARE_PER_KM
+        fallback = per_km * 1000
+        return [[max(per_km * distance if distance is not None else fallback,
+                     self.price_bound.estimate(codes[i], codes[j]))
+                 for j, distance in enumerate(row)] for i, row in enumerate(distances)]
+
+    def _local_search(self, n: int, days: List[int], leg_price, budget: float,
+                      rng: random.Random, pool_size: int) -> List[Tuple[int, ...]]:
+        stop = time.monotonic() + budget
+        
+        def cost(tour: Tuple[int, ...]) -> float:
+            return sum(leg_price(leg) for leg in self._tour_legs(tour, days, n))
+        
+        def neighbours(tour: Tuple[int, ...]):
+            for i in range(n - 1):
+                for j in range(i + 1, n):
+                    yield tour[:i] + tour[i:j + 1][::-1] + tour[j + 1:]
+            for length in (1, 2, 3):
+                for i in range(n - length + 1):
+                    segment, rest = tour[i:i + length], tour[:i] + tour[i + length:]
+                    for j in range(len(rest) + 1):
+                        if j != i:
+                            yield rest[:j] + segment + rest[j:]
+        
+        def descend(tour: Tuple[int, ...]) -> Tuple[Tuple[int, ...], float]:
+            best = cost(tour)
+            improved = True
+            while improved and time.monotonic() < stop:
+                improved = False
+                for candidate in neighbours(tour):
+                    candidate_cost = cost(candidate)
+                    if candidate_cost < best - 1e-9:
+                        tour, best, improved = candidate, candidate_cost, True
+                        break
+            return tour, best
+        
+        greedy, visited, previous, offset = [], set(), n, 0
+        for _ in range(n):
+            city = min((c for c in range(n) if c not in visited),
+                       key=lambda c: leg_price((previous, c, offset)))
+            greedy.append(city)
+            visited.add(city)
+            previous, offset = city, offset + days[city]
+        
+        pool: Dict[Tuple[int, ...], float] = {}
+        tour, best = descend(tuple(greedy))
+        pool[tour] = best
+        stale = 0
+        while time.monotonic() < stop and n > 1 and stale < 50:
+            kicked = list(min(pool, key=pool.get))
+            for _ in range(max(1, n // 4)):
+                i, j = rng.sample(range(n), 2)
+                kicked[i], kicked[j] = kicked[j], kicked[i]
+            tour, tour_cost = descend(tuple(kicked))
+            stale = stale + 1 if tour in pool else 0
+            pool[tour] = tour_cost
+            if len(pool) > pool_size * 4:
+                pool = dict(sorted(pool.items(), key=lambda item: item[1])[:pool_size])
+        
+        return [tour for tour, _ in sorted(pool.items(), key=lambda item: item[1])[:pool_size]]
+
+    def _solve_subset_dp(self, cities: List[str], middle_cities: List[Dict[str, Any]],
+                         prices: Dict[Tuple[int, int, int], float], start_date: str,
+                         num_results: int) -> List[Dict]:
+        n = len(middle_cities)
+        days = [city['days'] for city in middle_cities]
+        start, end = n, n + 1
+        k = max(num_results, 1)
+        
+        if n == 0:
+            price = prices.get((start, end, 0), 0.0)
+            if price <= 0:
+                return []
+            return [self._route_from_path([], cities, days, prices, start_date)]
+        
+        full = (1 << n) - 1
+        day_sum = [0] * (1 << n)
+        for mask in range(1, 1 << n):
+            low_bit = mask & -mask
+            day_sum[mask] = day_sum[mask ^ low_bit] + days[low_bit.bit_length() - 1]
+        
+        # best[mask][last] holds up to k partial routes as (cost, seq, last, parent) nodes,
+        # where parent is the node they were extended from. Keeping the k cheapest prefixes
+        # per state is exact: any complete route whose prefix is not among them is beaten by
+        # k routes sharing its suffix.
+        best: List[List[List[tuple]]] = [[[] for _ in range(n)] for _ in range(1 << n)]
+        seq = 0
+        
+        for j in range(n):
+            price = prices.get((start, j, 0), 0.0)
+            if price > 0:
+                best[1 << j][j].append((price, seq, j, None))
+                seq += 1
+        
+        finished = []
+        for mask in range(1, 1 << n):
+            offset = day_sum[mask]
+            for last in range(n):
+                entries = best[mask][last]
+                if not entries:
+                    continue
+                if mask == full:
+                    price = prices.get((last, end, offset), 0.0)
+                    if price > 0:
+                        finished.extend((node[0] + price, node[1], node) for node in entries)
+                    continue
+                for nxt in range(n):
+                    if mask & (1 << nxt):
+                        continue
+                    price = prices.get((last, nxt, offset), 0.0)
+                    if price <= 0:
+                        continue
+                    target = best[mask | (1 << nxt)][nxt]
+                    for node in entries:
+                        cost = node[0] + price
+                        if len(target) >= k and cost >= target[-1][0]:
+                            break
+                        bisect.insort(target, (cost, seq, nxt, node))
+                        seq += 1
+                        if len(target) > k:
+                            target.pop()
+        
+        finished.sort(key=lambda entry: (entry[0], entry[1]))
+        
+        routes = []
+        for _, _, node in finished[:k]:
+            order = []
+            while node is not None:
+                order.append(node[2])
+                node = node[3]
+            order.reverse()
+            routes.append(self._route_from_path(order, cities, days, prices, start_date))
+        
+        return routes
+
+    def _flex_horizon(self, middle_cities: List[Dict[str, Any]], start_date: str, end_date: str,
+                      date_flex: int) -> int:
+        try:
+            return (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days
+        except (TypeError, ValueError):
+            return sum(city['days'] for city in middle_cities) + date_flex * len(middle_cities)
+
+    # Flexible dates add a day dimension to the subset DP. Prices become a
+    # (from, to, departure day) tensor and every DP state holds a (day, k) array of the k
+    # cheapest ways to arrive in its city on each day, so all date shifts of a state are
+    # relaxed together as NumPy array operations instead of being enumerated per route.
+    def _solve_flexible_dates(self, cities: List[str], middle_cities: List[Dict[str, Any]],
+                              prices: Dict[Tuple[int, int, int], float], start_date: str,
+                              date_flex: int, horizon: int, num_results: int) -> List[Dict]:
+        if horizon < 0:
             return []
         
-        all_routes.sort(key=lambda x: x['total_cost'])
+        n = len(middle_cities)
+        start, end = n, n + 1
+        k = max(num_results, 1)
+        days_axis = horizon + 1
+        stays = self._stay_options(middle_cities, date_flex)
         
-        return all_routes[:num_results]
+        tensor = np.full((n + 2, n + 2, days_axis), np.inf)
+        for (from_index, to_index, offset), price in prices.items():
+            if price > 0 and offset <= horizon:
+                tensor[from_index, to_index, offset] = price
+        
+        # states[(mask, last)] = (cost, previous city, previous arrival day, previous rank),
+        # each shaped (days_axis, k); previous city -1 marks a leg from the start city.
+        states: Dict[Tuple[int, int], Tuple[np.ndarray, ...]] = {}
+        for j in range(n):
+            cost = np.full((days_axis, k), np.inf)
+            cost[0, 0] = tensor[start, j, 0]
+            if np.isfinite(cost[0, 0]):
+                states[(1 << j, j)] = (cost, np.full((days_axis, k), -1), np.zeros((days_axis, k), dtype=int),
+                                       np.zeros((days_axis, k), dtype=int))
+        
+        day_index = np.arange(days_axis)[:, None]
+        full = (1 << n) - 1
+        finals = []
+        
+        if n == 0:
+            finals.append((np.array([[tensor[start, end, 0]]]), -1, np.zeros((1, 1), dtype=int),
+                           np.zeros((1, 1), dtype=int), np.zeros((1, 1), dtype=int)))
+        
+        for mask in range(1, 1 << n):
+            for last in range(n):
+                state = states.get((mask, last))
+                if state is None:
+                    continue
+                cost = state[0]
+                
+                # Cheapest ways to leave `last` on each day: shift arrivals by every
+                # allowed stay length and keep the k best per departure day.
+                shifted = []
+                for stay in stays[last]:
+                    moved = np.full((days_axis, k), np.inf)
+                    if stay < days_axis:
+                        moved[stay:] = cost[:days_axis - stay]
+                    shifted.append(moved)
+                candidates = np.concatenate(shifted, axis=1)
+                order = np.argsort(candidates, axis=1, kind="stable")[:, :k]
+                departure_cost = np.take_along_axis(candidates, order, axis=1)
+                arrival_day = day_index - np.asarray(stays[last])[order // k]
+                arrival_rank = order % k
+                
+                if mask == full:
+                    finals.append((departure_cost + tensor[last, end][:, None], last,
+                                   np.broadcast_to(day_index, (days_axis, k)), arrival_day, arrival_rank))
+                    continue
+                
+                for nxt in range(n):
+                    if mask & (1 << nxt):
+                        continue
+                    arrival_cost = departure_cost + tensor[last, nxt][:, None]
+                    if not np.isfinite(arrival_cost).any():
+                        continue
+                    target_key = (mask | (1 << nxt), nxt)
+                    incoming = (arrival_cost, np.full((days_axis, k), last), arrival_day, arrival_rank)
+                    target = states.get(target_key)
+                    if target is None:
+                        states[target_key] = incoming
+                        continue
+                    merged = [np.concatenate(pair, axis=1) for pair in zip(target, incoming)]
+                    keep = np.argsort(merged[0], axis=1, kind="stable")[:, :k]
+                    states[target_key] = tuple(np.take_along_axis(column, keep, axis=1) for column in merged)
+        
+        ranked = []
+        for final_cost, last, departure_day, arrival_day, arrival_rank in finals:
+            for day, rank in zip(*np.nonzero(np.isfinite(final_cost))):
+                ranked.append((float(final_cost[day, rank]), last, int(departure_day[day, rank]),
+                               int(arrival_day[day, rank]), int(arrival_rank[day, rank])))
+        ranked.sort(key=lambda entry: entry[0])
+        
+        base_date = datetime.strptime(start_date, "%Y-%m-%d")
+        routes = []
+        for _, last, departure_day, arrival_day, rank in ranked[:k]:
+            stops = [(end, departure_day)]
+            mask = full
+            while last != -1:
+                stops.append((last, arrival_day))
+                previous, previous_day, previous_rank = (int(column[arrival_day, rank])
+                                                         for column in states[(mask, last)][1:])
+                mask ^= 1 << last
+                last, arrival_day, rank = previous, previous_day, previous_rank
+            stops.append((start, 0))
+            stops.reverse()
+            
+            route_cities = [cities[city] for city, _ in stops]
+            route_days = [0] + [stops[position + 1][1] - stops[position][1]
+                                for position in range(1, len(stops) - 1)] + [0]
+            individual_prices = [float(tensor[stops[position][0], stops[position + 1][0], stops[position + 1][1]])
+                                 for position in range(len(stops) - 1)]
+            flight_dates = [(base_date + timedelta(days=day)).strftime("%Y-%m-%d") for _, day in stops[1:]]
+            routes.append(self._build_route(route_cities, route_days, sum(individual_prices),
+                                            individual_prices, flight_dates))
+        
+        return routes
+
+    def _route_from_path(self, order: List[int], cities: List[str], days: List[int],
+                         prices: Dict[Tuple[int, int, int], float], start_date: str) -> Dict:
+        n = len(days)
+        base_date = datetime.strptime(start_date, "%Y-%m-%d")
+        stops = [n] + order + [n + 1]
+        route_cities = [cities[i] for i in stops]
+        route_days = [0] + [days[i] for i in order] + [0]
+        
+        individual_prices = []
+        flight_dates = []
+        offset = 0
+        for position in range(len(stops) - 1):
+            offset += route_days[position]
+            individual_prices.append(prices[(stops[position], stops[position + 1], offset)])
+            flight_dates.append((base_date + timedelta(days=offset)).strftime("%Y-%m-%d"))
+        
+        return self._build_route(route_cities, route_days, sum(individual_prices),
+                                 individual_prices, flight_dates)
     
     def _calculate_route_cost_with_dates_and_prices(self, route: List[str], days_per_city: List[int], start_date: str) -> Tuple[float, List[float], List[str]]:
         total_cost = 0
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+from backend.algorithm import RouteOptimizer
+from backend.price_cache import PriceKey
+
+logger = logging.getLogger(__name__)
+
+# Optimizes many trips together: every trip is planned first, the union of their price
+# keys is fetched once (trips that share a leg, date and passenger mix share the call),
+# and each trip is then solved against the shared price table. Batch trips can only use
+# the subset DP, or the flexible-date DP when date_flex is set: branch-and-bound and the
+# deadline search decide which legs to price one trip at a time, so /optimize/batch
+# rejects trips that ask for another engine or a deadline.
+async def optimize_batch(trips: List[Dict[str, Any]], make_optimizer: Callable[[Dict[str, Any]], RouteOptimizer],
+                         num_results: int = 3) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    results: List[Dict[str, Any]] = [{} for _ in trips]
+    planned = []
+    owners: Dict[PriceKey, RouteOptimizer] = {}
+    legs_requested = 0
+
+    for index, trip in enumerate(trips):
+        if not trip["start_city"] or not trip["end_city"]:
+            results[index] = {"status": "success", "message": "No routes found", "routes": []}
+            continue
+        optimizer = make_optimizer(trip)
+        try:
+            plan = optimizer.plan_trip(trip["start_city"], trip["end_city"], trip["middle_cities"],
+                                       trip["start_date"], trip["end_date"], trip.get("date_flex", 0))
+            keys = optimizer.price_keys(plan)
+        except Exception as e:
+            logger.warning(f"Could not plan batch trip {index}: {e}")
+            results[index] = {"status": "error", "detail": f"Planning failed: {str(e)}"}
+            continue
+        trip_keys = set(keys.values())
+        legs_requested += len(trip_keys)
+        for key in trip_keys:
+            owners.setdefault(key, optimizer)
+        planned.append((index, optimizer, plan, keys))
+
+    union = list(owners)
+    prices = await asyncio.gather(*(owners[key].get_price_async(key) for key in union))
+    price_table = dict(zip(union, prices))
+
+    async def solve(index: int, optimizer: RouteOptimizer, plan, keys):
+        leg_prices = {leg: price_table[key] for leg, key in keys.items()}
+        try:
+            routes = (await asyncio.to_thread(optimizer.solve_trip, plan, leg_prices, num_results))[:num_results]
+        except Exception as e:
+            logger.warning(f"Could not solve batch trip {index}: {e}")
+            results[index] = {"status": "error", "detail": f"Optimization failed: {str(e)}"}
+            return
+        if routes:
+            results[index] = {"status": "success", "count": len(routes), "routes": routes,
+                              "search_stats": optimizer.search_stats}
+        else:
+            results[index] = {"status": "success", "message": "No routes found", "routes": [],
+                              "search_stats": optimizer.search_stats}
+
+    await asyncio.gather(*(solve(*entry) for entry in planned))
+
+    stats = {
+        "trips": len(trips),
+        "legs_requested": legs_requested,
+        "legs_unique": len(union),
+        "api_calls_saved": legs_requested - len(union)
+    }
+    return results, stats
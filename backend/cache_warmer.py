@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from backend.algorithm import AsyncRateLimiter, RouteOptimizer
+from backend.circuit_breaker import CircuitBreaker
+from backend.metrics import warmer_prefetches
+from backend.price_cache import PriceCache, PriceKey
+from backend.quota import SharedTokenBucket
+from backend.result_cache import TripKey
+
+logger = logging.getLogger(__name__)
+
+# Append-only JSONL log of the trips users ask for. Entries are anonymised: cities are
+# stored as resolved IATA codes in sorted order, the timestamp is rounded down to the
+# hour, and nothing about the client is recorded.
+class TripLog:
+    def __init__(self, path: str, max_read_bytes: int = 8 * 1024 * 1024):
+        self.path = path
+        self.max_read_bytes = max_read_bytes
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    # Blocking file write; request handlers call it through asyncio.to_thread. A batch
+    # passes all of its trips so they are written with a single open.
+    def append(self, *keys: TripKey):
+        logged_at = int(time.time() // 3600 * 3600)
+        lines = "".join(json.dumps({
+            "logged_at": logged_at,
+            "start": key.start_iata,
+            "end": key.end_iata,
+            "middle": [list(city) for city in key.middle],
+            "start_date": key.start_date,
+            "end_date": key.end_date,
+            "adults": key.adults,
+            "children": key.children,
+            "infants": key.infants
+        }, separators=(",", ":")) + "\n" for key in keys)
+        try:
+            with self.lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+        except OSError as e:
+            logger.warning(f"Could not append to trip log {self.path}: {e}")
+
+    # Reads the newest entries, at most max_read_bytes from the end of the file, and
+    # skips lines that are not trip entries.
+    def read_recent(self, max_age_seconds: float) -> List[Dict[str, Any]]:
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - self.max_read_bytes))
+                if size > self.max_read_bytes:
+                    f.readline()
+                lines = f.read().decode("utf-8", errors="replace").splitlines()
+        except OSError:
+            return []
+
+        cutoff = time.time() - max_age_seconds
+        trips = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                if entry["logged_at"] >= cutoff and entry["start"] and entry["end"]:
+                    trips.append(entry)
+            except (ValueError, KeyError, TypeError):
+                continue
+        return trips
+
+# Keeps the legs that recent trips keep asking for warm in the shared price cache. Every
+# few minutes it replans the logged trips and counts their legs; between those mining
+# passes it refreshes the most popular legs that are missing or close to expiry. It
+# only spends upstream requests while the rate limiter has spare tokens, backs off
+# while the circuit breaker is open, and never exceeds its daily quota. With a
+# SharedTokenBucket the quota is counted in the bucket's file as its prefetch class,
+# so every worker's warmer draws on one host-wide allowance.
+class CacheWarmer:
+    def __init__(self, trip_log: TripLog, make_optimizer: Callable[[int, int, int], RouteOptimizer],
+                 price_cache: PriceCache, rate_limiter: AsyncRateLimiter, circuit_breaker: CircuitBreaker,
+                 daily_quota: int = 500, interval: float = 30.0, mine_interval: float = 600.0,
+                 top_legs: int = 200, min_count: int = 2, history_days: float = 7.0,
+                 refresh_ahead: float = 0.2, min_spare: float = 0.5, max_trips: int = 2000):
+        self.trip_log = trip_log
+        self.make_optimizer = make_optimizer
+        self.price_cache = price_cache
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.daily_quota = daily_quota
+        self.interval = interval
+        self.mine_interval = mine_interval
+        self.top_legs = top_legs
+        self.min_count = min_count
+        self.history_days = history_days
+        self.refresh_ahead = refresh_ahead
+        self.min_spare = min_spare
+        self.max_trips = max_trips
+        self.popular: List[PriceKey] = []
+        self.no_flights_until: Dict[PriceKey, float] = {}
+        self.mined_at = -float("inf")
+        self.quota_day = date.min
+        self.used_today = 0
+        self.prefetched = 0
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache warmer pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def tick(self):
+        if time.monotonic() - self.mined_at >= self.mine_interval:
+            self.popular = await asyncio.to_thread(self.mine)
+            self.mined_at = time.monotonic()
+
+        today = datetime.now(timezone.utc).date()
+        if today != self.quota_day:
+            self.quota_day, self.used_today = today, 0
+        if isinstance(self.rate_limiter, SharedTokenBucket):
+            await asyncio.to_thread(self.rate_limiter.refresh)
+
+        now = time.time()
+        today_text = today.isoformat()
+        for key in self.popular:
+            if self._quota_left() <= 0 or not self._has_spare_capacity():
+                break
+            if key.date < today_text or self.no_flights_until.get(key, 0) > now:
+                continue
+            # A cached 0.0 means the leg has no flights (or kept failing) and is already
+            # being retried on its own short TTL; fetching it again would waste quota.
+            if self.price_cache.blocking:
+                entry = await asyncio.to_thread(self.price_cache.peek, key)
+            else:
+                entry = self.price_cache.peek(key)
+            if entry is not None and (entry.price <= 0 or
+                                      entry.expires_at - now > self.refresh_ahead * self.price_cache.ttl):
+                continue
+
+            optimizer = self.make_optimizer(key.adults, key.children, key.infants)
+            price = await optimizer.refresh_price_async(key)
+            self.used_today += 1
+            self.prefetched += 1
+            warmer_prefetches.inc(result="priced" if price > 0 else "empty")
+            if price <= 0:
+                self.no_flights_until[key] = now + self.price_cache.negative_ttl
+
+    def _quota_left(self) -> int:
+        if isinstance(self.rate_limiter, SharedTokenBucket):
+            return self.daily_quota - self.rate_limiter.used_today("prefetch")
+        return self.daily_quota - self.used_today
+
+    def _has_spare_capacity(self) -> bool:
+        if self.circuit_breaker.stats()["state"] != CircuitBreaker.CLOSED:
+            return False
+        return self.rate_limiter.available() >= self.min_spare * self.rate_limiter.capacity
+
+    def mine(self) -> List[PriceKey]:
+        trips = self.trip_log.read_recent(self.history_days * 86400)[-self.max_trips:]
+        today = datetime.now(timezone.utc).date().isoformat()
+        counts: Counter = Counter()
+        for trip in trips:
+            if trip["end_date"] < today:
+                continue
+            try:
+                optimizer = self.make_optimizer(trip["adults"], trip["children"], trip["infants"])
+                middle = [{"name": code, "days": days} for code, days in trip["middle"]]
+                plan = optimizer.plan_trip(trip["start"], trip["end"], middle, trip["start_date"], trip["end_date"])
+                counts.update(key for key in set(optimizer.price_keys(plan).values()) if key.date >= today)
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        self.no_flights_until = {key: until for key, until in self.no_flights_until.items() if until > time.time()}
+        return [key for key, count in counts.most_common(self.top_legs) if count >= self.min_count]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "popular_legs": len(self.popular),
+            "prefetched": self.prefetched,
+            "used_today": self.daily_quota - self._quota_left(),
+            "daily_quota": self.daily_quota
+        }
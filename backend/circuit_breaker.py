@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, Optional
+
+# Stops calling an upstream that keeps failing: after `failure_threshold` consecutive
+# failures the circuit opens and calls fail fast for `reset_timeout` seconds, then a
+# single probe is let through (half-open) and its outcome closes or re-opens it. A
+# probe that ends without an outcome (cancelled, or stopped by the quota) is released
+# so the next call can probe; one that never reports is replaced after reset_timeout.
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.probe_generation = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        return self._admit() is not None
+
+    # Returns None when the call is rejected, otherwise the probe generation for a
+    # half-open probe (0 for an ordinary call).
+    def _admit(self) -> Optional[int]:
+        with self.lock:
+            now = time.monotonic()
+            if self.state == CircuitBreaker.OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return None
+                self.state = CircuitBreaker.HALF_OPEN
+                self.probing = False
+            if self.state == CircuitBreaker.HALF_OPEN:
+                if self.probing and now - self.probe_started < self.reset_timeout:
+                    self.rejected += 1
+                    return None
+                self.probing = True
+                self.probe_started = now
+                self.probe_generation += 1
+                return self.probe_generation
+            return 0
+
+    # Admits one upstream call for the duration of the block and releases its probe
+    # slot on every exit path, including cancellation.
+    @contextmanager
+    def call(self) -> Iterator[bool]:
+        generation = self._admit()
+        try:
+            yield generation is not None
+        finally:
+            if generation:
+                self._release_probe(generation)
+
+    def _release_probe(self, generation: int):
+        with self.lock:
+            if self.state == CircuitBreaker.HALF_OPEN and self.probe_generation == generation:
+                self.probing = False
+
+    # Cheap check that does not claim the probe, so callers can fail fast before
+    # spending a rate-limit token: true while the circuit is open, and while a half-open
+    # probe is already in flight.
+    def is_open(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            if self.state == CircuitBreaker.OPEN:
+                return now - self.opened_at < self.reset_timeout
+            return (self.state == CircuitBreaker.HALF_OPEN and self.probing
+                    and now - self.probe_started < self.reset_timeout)
+
+    def record_success(self):
+        with self.lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CircuitBreaker.OPEN:
+                    self.trips += 1
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def stats(self) -> Dict[str, object]:
+        with self.lock:
+            return {"state": self.state, "failures": self.failures,
+                    "rejected": self.rejected, "trips": self.trips}
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Full-jitter exponential backoff; a server-supplied Retry-After is a floor, with a
+# little jitter on top so throttled callers do not all come back at the same instant.
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base: float = 0.5, cap: float = 8.0) -> float:
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base))
+    return delay
+
+flight_api_breaker = CircuitBreaker()
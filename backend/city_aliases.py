@@ -0,0 +1,73 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# Alternative names and abbreviations, as folded text, mapped to the folded city name
+# used in airports.csv. The same map merges the dataset's own variant spellings (MXP is
+# listed under "Milano", LIN under "Milan").
+CITY_ALIASES = {
+    "nyc": "new york",
+    "new york city": "new york",
+    "la": "los angeles",
+    "sf": "san francisco",
+    "dc": "washington",
+    "washington dc": "washington",
+    "rio": "rio de janeiro",
+    "milano": "milan",
+    "roma": "rome",
+    "munchen": "munich",
+    "koln": "cologne",
+    "wien": "vienna",
+    "praha": "prague",
+    "lisboa": "lisbon",
+    "firenze": "florence",
+    "venezia": "venice",
+    "napoli": "naples",
+    "moskva": "moscow",
+    "kobenhavn": "copenhagen",
+    "bombay": "mumbai",
+    "calcutta": "kolkata",
+    "chennai": "madras",
+    "peking": "beijing",
+    "saigon": "ho chi minh city",
+}
+
+# airports.csv carries no traffic figures, so the main airport of the busiest
+# multi-airport cities is named here; other cities fall back to a heuristic.
+PRIMARY_AIRPORTS = {
+    "london": "LHR",
+    "new york": "JFK",
+    "paris": "CDG",
+    "tokyo": "HND",
+    "milan": "MXP",
+    "moscow": "SVO",
+    "rome": "FCO",
+    "chicago": "ORD",
+    "washington": "IAD",
+    "houston": "IAH",
+    "sao paulo": "GRU",
+    "rio de janeiro": "GIG",
+    "seoul": "ICN",
+    "shanghai": "PVG",
+    "beijing": "PEK",
+    "osaka": "KIX",
+    "buenos aires": "EZE",
+    "bangkok": "BKK",
+    "istanbul": "IST",
+}
+
+_NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+# Letters that have no Unicode decomposition into a base letter plus accent.
+_UNDECOMPOSABLE = str.maketrans({"ø": "o", "æ": "ae", "œ": "oe", "ł": "l", "đ": "d", "ð": "d", "þ": "th", "ı": "i"})
+
+# Lower-cases, drops accents and turns punctuation into single spaces, so
+# "São Paulo", "sao paulo" and "Sao-Paulo" all fold to "sao paulo".
+@lru_cache(maxsize=4096)
+def fold_name(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.casefold().translate(_UNDECOMPOSABLE))
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_ALPHANUMERIC.sub(" ", stripped).strip()
+
+def canonical_city(text: str) -> str:
+    folded = fold_name(text)
+    return CITY_ALIASES.get(folded, folded)
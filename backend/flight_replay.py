@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+from backend.iata_lookup import iata_lookup
+
+REQUEST_FIELDS = ("departure_id", "arrival_id", "outbound_date", "adults", "children", "infants", "currency")
+
+def recording_key(params: Dict[str, Any]) -> Tuple[str, ...]:
+    defaults = {"adults": "1", "children": "0", "infants": "0", "currency": "GBP"}
+    return tuple(str(params.get(field, defaults.get(field, ""))) for field in REQUEST_FIELDS)
+
+# Appends every searchFlights response to a JSONL file as {"request", "status", "body"}.
+class FlightRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, params: Dict[str, Any], status: int, body: Any):
+        line = json.dumps({"request": {field: params.get(field) for field in REQUEST_FIELDS if field in params},
+                           "status": status, "body": body})
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, recorder: FlightRecorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if "searchFlights" in request.url:
+            params = dict(httpx.URL(request.url).params)
+            try:
+                body = response.json()
+            except ValueError:
+                body = response.text
+            self.recorder.record(params, response.status_code, body)
+        return response
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, recorder: FlightRecorder, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.recorder = recorder
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        if "searchFlights" in request.url.path:
+            content = await response.aread()
+            try:
+                body = json.loads(content)
+            except ValueError:
+                body = content.decode("utf-8", errors="replace")
+            self.recorder.record(dict(request.url.params), response.status_code, body)
+            return httpx.Response(response.status_code, headers=response.headers, content=content,
+                                  request=request)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+# Serves recorded responses, or deterministic synthetic fares for legs that were never
+# recorded, with configurable latency and injected 429s and server errors, so the
+# optimizer can be exercised and benchmarked without a RapidAPI key.
+class FlightReplay:
+    def __init__(self, recordings: Optional[Dict[Tuple[str, ...], Tuple[int, Any]]] = None,
+                 latency: float = 0.0, latency_jitter: float = 0.0, rate_limit_ratio: float = 0.0,
+                 error_ratio: float = 0.0, synthetic: bool = True, no_flight_ratio: float = 0.05,
+                 seed: Optional[int] = None):
+        self.recordings = recordings or {}
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.synthetic = synthetic
+        self.no_flight_ratio = no_flight_ratio
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.statuses: Dict[int, int] = {}
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "FlightReplay":
+        recordings = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        recordings[recording_key(entry["request"])] = (entry["status"], entry["body"])
+        return cls(recordings, **kwargs)
+
+    def delay(self) -> float:
+        with self.lock:
+            jitter = self.random.uniform(-self.latency_jitter, self.latency_jitter) if self.latency_jitter else 0.0
+        return max(0.0, self.latency + jitter)
+
+    def respond(self, params: Dict[str, Any]) -> Tuple[int, Any, Dict[str, str]]:
+        with self.lock:
+            self.calls += 1
+            roll = self.random.random()
+
+        headers = {}
+        if roll < self.rate_limit_ratio:
+            status, body = 429, {"message": "Too many requests"}
+            headers["Retry-After"] = "1"
+        elif roll < self.rate_limit_ratio + self.error_ratio:
+            status, body = 500, {"message": "Upstream error"}
+        else:
+            key = recording_key(params)
+            if key in self.recordings:
+                status, body = self.recordings[key]
+            elif self.synthetic:
+                status, body = 200, self.synthetic_response(key)
+            else:
+                status, body = 404, {"status": False, "message": "Leg not recorded"}
+
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+        return status, body, headers
+
+    def synthetic_response(self, key: Tuple[str, ...]) -> Dict[str, Any]:
+        digest = int(hashlib.sha256("|".join(key).encode()).hexdigest(), 16)
+        if (digest % 10000) / 10000 < self.no_flight_ratio:
+            return {"status": True, "data": {"topFlights": [], "otherFlights": []}}
+
+        distance = iata_lookup.get_distance_km(key[0], key[1]) or 800.0
+        passengers = int(key[3]) + int(key[4]) + 0.1 * int(key[5])
+        factor = 0.8 + (digest % 800) / 1000
+        price = round((25 + 0.06 * distance) * factor * max(passengers, 1), 2)
+        return {"status": True, "data": {"topFlights": [{"price": price}],
+                                         "otherFlights": [{"price": round(price * 1.2, 2)}]}}
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = 0
+            self.statuses = {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"calls": self.calls, "statuses": dict(self.statuses)}
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, replay: FlightReplay):
+        super().__init__()
+        self.replay = replay
+
+    def send(self, request, **kwargs):
+        time.sleep(self.replay.delay())
+        status, body, headers = self.replay.respond(dict(httpx.URL(request.url).params))
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers.update({"Content-Type": "application/json", **headers})
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, replay: FlightReplay):
+        self.replay = replay
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.replay.delay())
+        status, body, headers = self.replay.respond(dict(request.url.params))
+        return httpx.Response(status, json=body, headers=headers, request=request)
@@ -0,0 +1,16 @@
+from typing import Optional
+import httpx
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+def create_http_session(pool_size: int = 16, adapter: Optional[BaseAdapter] = None) -> requests.Session:
+    session = requests.Session()
+    adapter = adapter or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def create_async_http_client(max_connections: int = 32,
+                             transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(limits=limits, timeout=15.0, transport=transport)
@@ -1,100 +1,381 @@
 import csv
+import heapq
+import logging
 import os
 import random
-from typing import Dict, List, Optional
+import threading
+from array import array
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+from backend.airport_snapshot import Sections, default_snapshot_path, read_snapshot, write_snapshot
+from backend.airport_store import (AirportTable, AirportMapping, CityMapping, Records, index_view, pack_index_keys,
+                                   pack_postings, pack_strings, postings_view, strings_view)
+from backend.city_aliases import PRIMARY_AIRPORTS, canonical_city, fold_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT = object()
+
+# Airports of one city name further apart than this are treated as different places
+# (London, UK and London, Ontario), which makes the name ambiguous.
+SAME_PLACE_KM = 150.0
+
+AIRPORT_NAME_SUFFIXES = ("international airport", "airport")
+
+class CityChoice(NamedTuple):
+    rows: Sequence[int]
+    first: int
+    largest: int
+    alternatives: Sequence[int]
+
+# matched_by is "iata", "city" or "airport_name" for a known airport; "code" for an
+# upper-case three-letter code passed through as given (such as the metropolitan codes
+# LON and PAR); "search" for a best guess from the prefix index; or "unresolved".
+class Resolution(NamedTuple):
+    iata: Optional[str]
+    matched_by: str
+    alternatives: Tuple[str, ...] = ()
+
+    @property
+    def ambiguous(self) -> bool:
+        return bool(self.alternatives)
+
+    @property
+    def exact(self) -> bool:
+        return self.matched_by in ("iata", "city", "airport_name")
 
 class IATALookup:
-    def __init__(self, csv_file: str = "airports.csv"):
-        self.airports: Dict[str, Dict] = {}
-        self.city_to_airports: Dict[str, List[Dict]] = {}
-        self.load_airports_data(csv_file)
+    STATE_ATTRIBUTES = ("table", "city_rows", "prefix_tiers", "ngram_index", "city_choices", "airport_names",
+                        "search_rank")
+    LAZY_ATTRIBUTES = STATE_ATTRIBUTES + ("sections", "airports", "city_to_airports")
+    PREFIX_TIERS = 3
+
+    # Airport data is loaded on first use rather than at import: from the compiled
+    # snapshot when it matches airports.csv, otherwise by parsing the CSV and writing a
+    # fresh snapshot. Either way the tables and indexes end up as read-only views of
+    # one mapped file, so extra uvicorn workers share its pages instead of each
+    # holding their own dicts and strings.
+    def __init__(self, csv_file: str = "airports.csv", snapshot_file: Any = DEFAULT_SNAPSHOT):
+        self.csv_file = csv_file
+        self.snapshot_file = default_snapshot_path(csv_file) if snapshot_file is DEFAULT_SNAPSHOT else snapshot_file
+        self.load_lock = threading.Lock()
+        self.loaded = False
+
+    def __getattr__(self, name: str):
+        if name in IATALookup.LAZY_ATTRIBUTES:
+            self.ensure_loaded()
+            return self.__dict__[name]
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        with self.load_lock:
+            if self.loaded:
+                return
+            sections = read_snapshot(self.snapshot_file, self.csv_file) if self.snapshot_file else None
+            if sections is None:
+                if self.snapshot_file:
+                    logger.info(f"Airport snapshot {self.snapshot_file} missing or stale, parsing {self.csv_file}")
+                self.load_airports_data(self.csv_file)
+                self.build_search_index()
+                self.build_resolver()
+                sections = self.share_sections(self.pack_state())
+            self.attach_sections(sections)
+            self.airports: Mapping[str, Dict] = AirportMapping(self.table)
+            self.city_to_airports: Mapping[str, List[Dict]] = CityMapping(self.table, self.city_rows)
+            self.loaded = True
+
+    def export_sections(self) -> Sections:
+        self.ensure_loaded()
+        return self.sections
+
+    # Flattens the freshly built tables and indexes into named typed arrays.
+    def pack_state(self) -> Sections:
+        sections: Sections = {}
+        self.table.pack(sections)
+        pack_postings(sections, "city_rows", pack_index_keys(sections, "city_rows", self.city_rows))
+        for tier, (keys, entry_ids) in enumerate(self.prefix_tiers):
+            pack_strings(sections, f"prefix_tiers.{tier}", keys)
+            sections[f"prefix_tiers.{tier}.entry_ids"] = entry_ids
+        pack_postings(sections, "ngram_index", pack_index_keys(sections, "ngram_index", self.ngram_index))
+        choices = pack_index_keys(sections, "city_choices", self.city_choices)
+        pack_postings(sections, "city_choices.rows", (choice.rows for choice in choices))
+        sections["city_choices.first"] = array("I", (choice.first for choice in choices))
+        sections["city_choices.largest"] = array("I", (choice.largest for choice in choices))
+        pack_postings(sections, "city_choices.alternatives", (choice.alternatives for choice in choices))
+        sections["airport_names"] = array("I", pack_index_keys(sections, "airport_names", self.airport_names))
+        sections["search_rank"] = self.search_rank
+        return sections
+
+    # Writes the sections as the snapshot and maps it back, so this and later workers
+    # read the same pages. Keeps the private in-memory copy if the file can't be written.
+    def share_sections(self, sections: Sections) -> Sections:
+        if not self.snapshot_file:
+            return sections
+        try:
+            write_snapshot(self.snapshot_file, self.csv_file, sections)
+        except OSError as e:
+            logger.warning(f"Could not write airport snapshot {self.snapshot_file}: {e}")
+            return sections
+        return read_snapshot(self.snapshot_file, self.csv_file) or sections
+
+    def attach_sections(self, sections: Sections):
+        self.sections = sections
+        self.table = AirportTable.from_sections(sections)
+        self.city_rows = index_view(sections, "city_rows", postings_view(sections, "city_rows"))
+        self.prefix_tiers = [(strings_view(sections, f"prefix_tiers.{tier}"), sections[f"prefix_tiers.{tier}.entry_ids"])
+                             for tier in range(IATALookup.PREFIX_TIERS)]
+        self.ngram_index = index_view(sections, "ngram_index", postings_view(sections, "ngram_index"))
+        self.city_choices = index_view(sections, "city_choices", Records(
+            CityChoice, postings_view(sections, "city_choices.rows"), sections["city_choices.first"],
+            sections["city_choices.largest"], postings_view(sections, "city_choices.alternatives")))
+        self.airport_names = index_view(sections, "airport_names", sections["airport_names"])
+        self.search_rank = sections["search_rank"]
 
     def load_airports_data(self, csv_file: str):
         if not os.path.exists(csv_file):
             raise FileNotFoundError(f"{csv_file} not found. Include it in your project folder.")
 
+        self.table = AirportTable()
+        city_rows: Dict[str, List[int]] = {}
         with open(csv_file, encoding="utf-8") as f:
             reader = csv.reader(f)
             for row in reader:
                 if len(row) >= 6:
-                    airport_id, name, city, country, iata, icao = row[:6]
-                    if iata and iata != "\\N" and len(iata) == 3:
-                        airport_info = {
-                            "name": name,
-                            "city": city,
-                            "country": country,
-                            "iata": iata,
-                            "icao": icao
-                        }
-                        self.airports[iata] = airport_info
-                        city_key = city.lower().strip()
-                        self.city_to_airports.setdefault(city_key, []).append(airport_info)
+                    iata = row[4]
+                    if iata and iata != "\\N" and len(iata) == 3 and iata not in self.table.iata_rows:
+                        row_id = self.table.append_csv_row(row)
+                        city_key = row[2].lower().strip()
+                        city_rows.setdefault(city_key, []).append(row_id)
+        
+        self.city_rows: Dict[str, array] = {city: array("I", rows) for city, rows in city_rows.items()}
+        self.table.build_spatial_index()
 
     def get_airports_by_city(self, city_name: str) -> List[Dict]:
+        choice = self.city_choices.get(canonical_city(city_name))
+        if choice is not None:
+            return [self.table.row(row_id) for row_id in choice.rows]
         return self.city_to_airports.get(city_name.lower().strip(), [])
     
     def get_airport_by_iata(self, iata_code: str) -> Optional[Dict]:
         return self.airports.get(iata_code.upper())
 
-    def get_iata_code(self, input_text: str) -> str:
-        if len(input_text) == 3 and input_text.isalpha() and input_text.isupper():
-            if input_text in self.airports:
-                return input_text
+    # Name resolution is precomputed by build_resolver(): city names and aliases are
+    # folded (case, accents, punctuation) and each city's airport is chosen up front,
+    # so resolving a name is a handful of hash lookups. The search index is the last
+    # resort, for partial airport names such as "heathrow".
+    def build_resolver(self):
+        groups: Dict[str, List[int]] = {}
+        for row_id, city in enumerate(self.table.cities):
+            key = canonical_city(city)
+            if key:
+                groups.setdefault(key, []).append(row_id)
+        
+        self.city_choices: Dict[str, CityChoice] = {}
+        for key, rows in groups.items():
+            places = self._group_by_place(rows)
+            primary = self.table.row_for_iata(PRIMARY_AIRPORTS.get(key, ""))
+            main_place = max(places, key=lambda place: (primary in place, len(place),
+                                                        any(self._is_international(row) for row in place)))
+            alternatives = tuple(self._main_airport(place) for place in places if place is not main_place)
+            largest = primary if primary is not None else self._main_airport(main_place)
+            self.city_choices[key] = CityChoice(array("I", rows), rows[0], largest, alternatives)
+        
+        self.airport_names: Dict[str, int] = {}
+        for row_id, name in enumerate(self.table.names):
+            folded = fold_name(name)
+            self.airport_names.setdefault(folded, row_id)
+            for suffix in AIRPORT_NAME_SUFFIXES:
+                if folded.endswith(" " + suffix):
+                    self.airport_names.setdefault(folded[:-len(suffix) - 1], row_id)
+                    break
+        
+        # Static relevance of each airport for search suggestions, lower first: airports
+        # of the major cities in PRIMARY_AIRPORTS, then of cities with more airports, and
+        # within a city its chosen main airport, the rest of that place, then airports of
+        # a same-named place elsewhere (London, Ontario after London's own airports).
+        self.search_rank = array("I", [1 << 13] * len(self.table))
+        for key, choice in self.city_choices.items():
+            major = 0 if key in PRIMARY_AIRPORTS else 1
+            size = 255 - min(len(choice.rows), 255)
+            for row_id in choice.rows:
+                distance = self.table.distance_km(choice.largest, row_id)
+                far = 1 if distance is not None and distance > SAME_PLACE_KM else 0
+                main = 0 if row_id == choice.largest else 1
+                international = 0 if self._is_international(row_id) else 1
+                self.search_rank[row_id] = major << 12 | size << 4 | far << 2 | main << 1 | international
+
+    def _group_by_place(self, rows: List[int]) -> List[List[int]]:
+        places: List[List[int]] = []
+        for row_id in rows:
+            for place in places:
+                distance = self.table.distance_km(place[0], row_id)
+                if distance is not None and distance <= SAME_PLACE_KM:
+                    place.append(row_id)
+                    break
             else:
-                return input_text
+                places.append([row_id])
+        return places
+
+    def _is_international(self, row_id: int) -> bool:
+        return "international" in self.table.names[row_id].lower()
+
+    def _main_airport(self, rows: List[int]) -> int:
+        return next((row_id for row_id in rows if self._is_international(row_id)), rows[0])
+
+    def resolve(self, input_text: str, strategy: str = "largest") -> Resolution:
+        text = input_text.strip()
+        if len(text) == 3 and text.isalpha() and text.isupper():
+            return Resolution(text, "iata" if text in self.airports else "code")
+        
+        choice = self.city_choices.get(canonical_city(text))
+        if choice is not None:
+            alternatives = tuple(self.table.iatas[row_id] for row_id in choice.alternatives)
+            return Resolution(self.table.iatas[self._choose(choice, strategy)], "city", alternatives)
         
-        iata_code = self.get_iata_for_city(input_text)
-        if iata_code:
-            return iata_code
+        row_id = self.airport_names.get(fold_name(text))
+        if row_id is not None:
+            return Resolution(self.table.iatas[row_id], "airport_name")
         
-        input_upper = input_text.upper()
-        if input_upper in self.airports:
-            return input_upper
+        if text.upper() in self.airports:
+            return Resolution(text.upper(), "iata")
         
-        for iata, airport in self.airports.items():
-            if (input_text.lower() in airport['name'].lower() or 
-                input_text.lower() in airport['city'].lower()):
-                return iata
+        # A partial city name ("Lond") stands for the whole city, so it goes through
+        # the same airport choice as the full name rather than the first row it matched.
+        query = text.lower()
+        if len(query) >= 2:
+            for tier in range(len(self.prefix_tiers)):
+                matches = self._prefix_matches(query, tier, 1, set())
+                if matches:
+                    row_id = matches[0]
+                    choice = self.city_choices.get(canonical_city(self.table.cities[row_id])) if tier == 0 else None
+                    if choice is not None:
+                        row_id = self._choose(choice, strategy)
+                    return Resolution(self.table.iatas[row_id], "search")
         
-        return input_text[:3].upper()
+        return Resolution(None, "unresolved")
+
+    def _choose(self, choice: CityChoice, strategy: str) -> int:
+        if len(choice.rows) == 1 or strategy == "first":
+            return choice.first
+        if strategy == "random":
+            return random.choice(choice.rows)
+        return choice.largest
+
+    def get_iata_code(self, input_text: str) -> str:
+        resolution = self.resolve(input_text)
+        if resolution.iata:
+            return resolution.iata
+        return input_text.strip()[:3].upper()
 
     def get_iata_for_city(self, city_name: str, strategy: str = "largest") -> Optional[str]:
-        city_name = city_name.lower().strip()
-        airports = self.city_to_airports.get(city_name, [])
-        if not airports:
+        choice = self.city_choices.get(canonical_city(city_name))
+        if choice is None:
             return None
-        if len(airports) == 1:
-            return airports[0]["iata"]
-        if strategy == "first":
-            return airports[0]["iata"]
-        elif strategy == "random":
-            return random.choice(airports)["iata"]
-        elif strategy == "largest":
-            sorted_airports = sorted(airports, key=lambda x: "international" in x["name"].lower(), reverse=True)
-            return sorted_airports[0]["iata"]
+        return self.table.iatas[self._choose(choice, strategy)]
+
+    # Suggestions are ranked in tiers: city name prefix, IATA code prefix, prefix of any
+    # word in the city or airport name, and finally plain substring matches. Each prefix
+    # tier is a sorted key list searched with bisect; substrings go through an n-gram
+    # inverted index, so no query scans the airport table. Within a tier an exact match
+    # comes first, then the precomputed search_rank (major cities and main airports).
+    def build_search_index(self):
+        tiers: List[List[Tuple[str, int]]] = [[] for _ in range(IATALookup.PREFIX_TIERS)]
+        ngram_index: Dict[str, Set[int]] = {}
+        
+        for entry_id in range(len(self.table)):
+            city, name, iata = self._search_fields(entry_id)
+            
+            if city:
+                tiers[0].append((city, entry_id))
+            tiers[1].append((iata, entry_id))
+            city_words = city.split()
+            name_words = name.split()
+            for position in range(1, len(city_words)):
+                tiers[2].append((" ".join(city_words[position:]), entry_id))
+            for position in range(len(name_words)):
+                tiers[2].append((" ".join(name_words[position:]), entry_id))
+            
+            for text in (city, name, iata):
+                for size in (2, 3):
+                    for start in range(len(text) - size + 1):
+                        ngram_index.setdefault(text[start:start + size], set()).add(entry_id)
+        
+        self.prefix_tiers: List[Tuple[List[str], array]] = []
+        for tier in tiers:
+            tier.sort()
+            self.prefix_tiers.append(([key for key, _ in tier], array("I", [entry_id for _, entry_id in tier])))
+        self.ngram_index: Dict[str, array] = {
+            gram: array("I", sorted(entry_ids)) for gram, entry_ids in ngram_index.items()
+        }
+
+    def _search_fields(self, row_id: int) -> Tuple[str, str, str]:
+        table = self.table
+        return table.cities[row_id].lower().strip(), table.names[row_id].lower().strip(), table.iatas[row_id].lower()
+
+    def _suggestion_text(self, row_id: int) -> str:
+        table = self.table
+        return f"{table.cities[row_id]} ({table.iatas[row_id]}) - {table.names[row_id]}"
+
+    def _prefix_matches(self, query: str, tier: int, limit: int, seen: Set[int]) -> List[int]:
+        if limit <= 0:
+            return []
+        keys, entry_ids = self.prefix_tiers[tier]
+        candidates: Dict[int, Tuple[bool, int, int]] = {}
+        position, end = keys.bisect_left(query), len(keys)
+        while position < end:
+            key = keys[position]
+            if not key.startswith(query):
+                break
+            entry_id = entry_ids[position]
+            if entry_id not in seen:
+                order = (key != query, self.search_rank[entry_id], position)
+                candidates[entry_id] = min(order, candidates.get(entry_id, order))
+            position += 1
+        matches = heapq.nsmallest(limit, candidates, key=candidates.__getitem__)
+        seen.update(matches)
+        return matches
+
+    def _infix_matches(self, query: str, limit: int, seen: Set[int]) -> List[int]:
+        size = 3 if len(query) >= 3 else 2
+        postings = []
+        for start in range(len(query) - size + 1):
+            posting = self.ngram_index.get(query[start:start + size])
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        others = [set(posting) for posting in postings[1:]]
+        
+        matches = []
+        for entry_id in postings[0]:
+            if entry_id in seen or not all(entry_id in other for other in others):
+                continue
+            if any(query in field for field in self._search_fields(entry_id)):
+                seen.add(entry_id)
+                matches.append(entry_id)
+                if len(matches) >= limit:
+                    break
+        return matches
 
     def search_airports(self, query: str, max_results: int = 7) -> List[str]:
         if not query or len(query) < 2:
             return []
         
         query_lower = query.lower().strip()
-        suggestions = []
-        
-        for city_name, airports in self.city_to_airports.items():
-            if query_lower in city_name:
-                for airport in airports:
-                    display_text = f"{airport['city']} ({airport['iata']}) - {airport['name']}"
-                    if display_text not in suggestions:
-                        suggestions.append(display_text)
+        if not query_lower:
+            return []
         
-        for airport in self.airports.values():
-            if (query_lower in airport['name'].lower() or 
-                query_lower in airport['iata'].lower()):
-                display_text = f"{airport['city']} ({airport['iata']}) - {airport['name']}"
-                if display_text not in suggestions:
-                    suggestions.append(display_text)
+        seen: Set[int] = set()
+        entry_ids: List[int] = []
+        for tier in range(len(self.prefix_tiers)):
+            entry_ids.extend(self._prefix_matches(query_lower, tier, max_results - len(entry_ids), seen))
+            if len(entry_ids) >= max_results:
+                break
+        else:
+            entry_ids.extend(self._infix_matches(query_lower, max_results - len(entry_ids), seen))
         
-        return suggestions[:max_results]
+        return [self._suggestion_text(entry_id) for entry_id in entry_ids]
 
     def search_cities(self, query: str, limit: int = 5) -> List[str]:
         return self.search_airports(query, max_results=limit)
@@ -104,8 +385,29 @@ class IATALookup:
 
     def get_airports_by_country(self, country: str) -> List[Dict]:
         country_lower = country.lower().strip()
-        return [airport for airport in self.airports.values() 
-                if airport['country'].lower() == country_lower]
+        return [self.table.row(row_id) for row_id, airport_country in enumerate(self.table.countries)
+                if airport_country.lower() == country_lower]
+
+    def get_nearby_airports(self, lat: float, lon: float, k: int = 5,
+                            radius_km: Optional[float] = None) -> List[Dict]:
+        if radius_km is None:
+            matches = self.table.nearest(lat, lon, k)
+        else:
+            matches = self.table.within_radius(lat, lon, radius_km)[:k]
+        
+        airports = []
+        for row_id, distance_km in matches:
+            airport = self.table.row(row_id)
+            airport["distance_km"] = round(distance_km, 1)
+            airports.append(airport)
+        return airports
+
+    def get_distance_km(self, from_iata: str, to_iata: str) -> Optional[float]:
+        from_row = self.table.row_for_iata(from_iata.upper())
+        to_row = self.table.row_for_iata(to_iata.upper())
+        if from_row is None or to_row is None:
+            return None
+        return self.table.distance_km(from_row, to_row)
 
     def get_airport_count(self) -> int:
         return len(self.airports)
@@ -0,0 +1,172 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in (labels or {}).items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.lock = threading.Lock()
+        self.series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0.0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for index, bound in enumerate(self.buckets):
+                    bucket_label = ("le", _format_value(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(key, bucket_label)} {_format_value(series[index])}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {_format_value(series[-1])}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, read: Callable[[], Dict[LabelKey, float]]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.read()
+        except Exception:
+            return lines
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    # read() returns {labels dict as a sorted tuple of pairs: value}; use gauge_values()
+    # to build it from plain dicts.
+    def gauge(self, name: str, help_text: str, read: Callable[[], Dict[LabelKey, float]]) -> Gauge:
+        gauge = Gauge(name, help_text, read)
+        self.metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def gauge_values(*entries: Tuple[Dict[str, str], float]) -> Dict[LabelKey, float]:
+    return {_label_key(labels): value for labels, value in entries}
+
+registry = MetricsRegistry()
+
+phase_seconds = registry.histogram(
+    "optimizer_phase_seconds", "Time spent per optimizer phase occurrence, by phase")
+optimize_seconds = registry.histogram(
+    "optimize_request_seconds", "End-to-end /optimize latency, by endpoint and outcome")
+price_lookups = registry.counter(
+    "flight_price_lookups_total", "Leg price lookups by cache result")
+api_responses = registry.counter(
+    "flight_api_responses_total", "Upstream searchFlights responses by HTTP status")
+api_events = registry.counter(
+    "flight_api_events_total", "Upstream fetch events: rate_limited, retry, server_error, client_error, null_price, error, gave_up, circuit_open, quota_exhausted")
+warmer_prefetches = registry.counter(
+    "cache_warmer_prefetches_total", "Leg prices refreshed ahead of demand by the cache warmer, by result")
+
+# Per-request timing breakdown. Phases accumulate wall time, so phases that overlap
+# across concurrent fetches can add up to more than the request took; each occurrence
+# is also observed into the process-wide phase histogram.
+class RequestTimings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        phase_seconds.observe(seconds, phase=name)
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def as_dict(self) -> Dict[str, object]:
+        with self.lock:
+            return {
+                "total_seconds": round(time.perf_counter() - self.started, 6),
+                "phases_seconds": {name: round(value, 6) for name, value in sorted(self.phases.items())},
+                "counts": dict(sorted(self.counts.items()))
+            }
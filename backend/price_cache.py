@@ -0,0 +1,220 @@
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+class PriceKey(NamedTuple):
+    from_iata: str
+    to_iata: str
+    date: str
+    adults: int
+    children: int
+    infants: int
+    currency: str
+
+    def serialize(self) -> str:
+        return "|".join(str(part) for part in self)
+
+class CachedPrice(NamedTuple):
+    price: float
+    expires_at: float
+
+# `blocking` tells async callers whether lookups and writes can stall (SQLite may wait
+# on another worker's write lock), so they run them in a thread instead of on the loop.
+class PriceCache(ABC):
+    blocking = False
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 50000, negative_ttl: float = 300.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def get(self, key: PriceKey) -> Optional[float]:
+        entry = self.lookup(key)
+        return None if entry is None else entry.price
+
+    # Like get(), but also returns when the entry expires, so callers can tell how long
+    # anything computed from the price stays valid.
+    @abstractmethod
+    def lookup(self, key: PriceKey) -> Optional[CachedPrice]:
+        ...
+
+    @abstractmethod
+    def set(self, key: PriceKey, price: float, ttl: Optional[float] = None):
+        ...
+
+    # Like lookup(), but neither counts in the hit/miss statistics nor marks the entry
+    # as recently used; for housekeeping such as the cache warmer.
+    @abstractmethod
+    def peek(self, key: PriceKey) -> Optional[CachedPrice]:
+        ...
+
+    # A leg with no flights (or one that kept failing) is cached as 0.0 for a short
+    # while, so every route through it does not ask the API again.
+    def set_negative(self, key: PriceKey, ttl: Optional[float] = None):
+        self.set(key, 0.0, self.negative_ttl if ttl is None else ttl)
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def _record(self, entry: Optional[CachedPrice]) -> Optional[CachedPrice]:
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if entry.price <= 0:
+                self.negative_hits += 1
+        return entry
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "size": len(self),
+            "max_entries": self.max_entries
+        }
+
+class MemoryPriceCache(PriceCache):
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 50000, negative_ttl: float = 300.0):
+        super().__init__(ttl=ttl, max_entries=max_entries, negative_ttl=negative_ttl)
+        self.entries: "OrderedDict[PriceKey, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, key: PriceKey) -> Optional[CachedPrice]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return self._record(None)
+            price, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return self._record(None)
+            self.entries.move_to_end(key)
+            return self._record(CachedPrice(price, expires_at))
+
+    def peek(self, key: PriceKey) -> Optional[CachedPrice]:
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return CachedPrice(*entry)
+
+    def set(self, key: PriceKey, price: float, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (price, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+# One SQLite file in WAL mode can be opened by every uvicorn worker on the host, so a
+# leg priced by one worker is a cache hit for all of them. The LRU order is approximate:
+# a hit only rewrites last_used once it is touch_interval seconds old, so hot legs are
+# read without taking the database write lock, and expired rows are left for _evict.
+class SQLitePriceCache(PriceCache):
+    blocking = True
+
+    def __init__(self, path: str, ttl: float = 3600.0, max_entries: int = 50000,
+                 negative_ttl: float = 300.0, touch_interval: float = 300.0):
+        super().__init__(ttl=ttl, max_entries=max_entries, negative_ttl=negative_ttl)
+        self.path = path
+        self.touch_interval = touch_interval
+        self.local = threading.local()
+        self.writes = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prices ("
+                "key TEXT PRIMARY KEY, price REAL NOT NULL, "
+                "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS prices_last_used ON prices (last_used)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def lookup(self, key: PriceKey) -> Optional[CachedPrice]:
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT price, expires_at, last_used FROM prices WHERE key = ?", (key.serialize(),)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return self._record(None)
+            price, expires_at, last_used = row
+            if now - last_used >= self.touch_interval:
+                with conn:
+                    conn.execute("UPDATE prices SET last_used = ? WHERE key = ?", (now, key.serialize()))
+            return self._record(CachedPrice(price, expires_at))
+        except sqlite3.Error:
+            return self._record(None)
+
+    def peek(self, key: PriceKey) -> Optional[CachedPrice]:
+        try:
+            row = self._connection().execute(
+                "SELECT price, expires_at FROM prices WHERE key = ?", (key.serialize(),)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[1] <= time.time():
+            return None
+        return CachedPrice(*row)
+
+    def set(self, key: PriceKey, price: float, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO prices (key, price, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key.serialize(), price, expires_at, now)
+                )
+            with self.lock:
+                self.writes += 1
+                should_evict = self.writes % 100 == 0
+            if should_evict:
+                self._evict(now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, now: float):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM prices WHERE expires_at <= ?", (now,))
+            overflow = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM prices WHERE key IN "
+                    "(SELECT key FROM prices ORDER BY last_used LIMIT ?)", (overflow,)
+                )
+                self.evictions += overflow
+
+    def __len__(self) -> int:
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+        except sqlite3.Error:
+            return 0
@@ -0,0 +1,357 @@
+import asyncio
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PRIORITIES = ("interactive", "batch", "prefetch")
+
+# Share of the bucket a request of each class must leave untouched. Interactive
+# requests may drain it (and queue behind each other in token debt); batch and
+# prefetch traffic only draws while the bucket is comfortably full, so they always
+# yield to users waiting on /optimize.
+PRIORITY_RESERVE = {"interactive": 0.0, "batch": 0.2, "prefetch": 0.5}
+
+STATE_MAGIC = b"FOQUOTA1"
+STATE_FORMAT = "<8sI4d5q"
+STATE_SIZE = struct.calcsize(STATE_FORMAT)
+
+class QuotaExhausted(Exception):
+    pass
+
+# Priority of one upstream call that several requests may share through single-flight.
+# A joiner can only make it more urgent, so an interactive request that joins a batch
+# or prefetch fetch is not left waiting behind their reserves; listeners (a call queued
+# in SharedTokenBucket) are told when that happens.
+class CallPriority:
+    def __init__(self, name: str = "interactive"):
+        if name not in PRIORITIES:
+            raise ValueError(f"Unknown priority {name!r}; expected one of {PRIORITIES}")
+        self.name = name
+        self.listeners: List[Callable[[], None]] = []
+
+    def join(self, other: "CallPriority"):
+        if PRIORITIES.index(other.name) < PRIORITIES.index(self.name):
+            self.name = other.name
+            for listener in list(self.listeners):
+                listener()
+
+def priority_name(priority: Union[str, CallPriority]) -> str:
+    return priority.name if isinstance(priority, CallPriority) else priority
+
+# One call waiting in a SharedTokenBucket class queue. wake() may come from any thread;
+# a wake that arrives before the waiter sleeps is not lost, it just returns at once.
+class _Waiter:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.queue: Optional[str] = None
+        self.lock = threading.Lock()
+        self.woken = False
+        self.future: Optional[asyncio.Future] = None
+        self.event = threading.Event()
+
+    def wake(self):
+        with self.lock:
+            self.woken = True
+            if self.loop is None:
+                self.event.set()
+            elif self.future is not None:
+                self.loop.call_soon_threadsafe(_resolve, self.future)
+
+    async def wait(self, timeout: Optional[float] = None):
+        with self.lock:
+            if self.woken:
+                self.woken = False
+                return
+            self.future = self.loop.create_future()
+        try:
+            await asyncio.wait_for(self.future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self.lock:
+            self.woken = False
+            self.future = None
+
+    def block(self, timeout: Optional[float] = None):
+        self.event.wait(timeout)
+        with self.lock:
+            self.woken = False
+            self.event.clear()
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+def default_state_path() -> str:
+    return os.path.join(tempfile.gettempdir(), "flight-optimizer-quota.bin")
+
+# Host-wide token bucket for the flight API. The bucket lives in a small state file
+# that every worker process maps the same way; each update happens under an exclusive
+# flock, so all uvicorn workers and all requests draw from one budget. It adapts to
+# throttling like the in-process limiters, counts calls per UTC day against an
+# optional daily limit (overall and per class), and can stand in for both RateLimiter
+# and AsyncRateLimiter.
+# Without fcntl (Windows) the bucket is shared by the threads of one process only.
+#
+# The file is only touched when a token is taken: acquire() does that in a worker
+# thread, and outcomes (success, throttle, refund) are buffered in memory and applied
+# on the next take, so nothing on the event loop blocks on the lock or the disk.
+# available(), rate and stats() report the state as of the last take.
+#
+# Batch and prefetch calls that must wait for their reserve queue per class within the
+# process. Only the head of each queue tries the file, sleeping for the computed token
+# deficit in between, and the others sleep until they reach the head, so thousands of
+# waiting legs cost a couple of file operations per token rather than one each. A call
+# raised to interactive while queued leaves its queue at once.
+class SharedTokenBucket:
+    def __init__(self, path: Optional[str] = None, rate: float = 10.0, burst: int = 10,
+                 daily_limit: int = 0, min_rate: float = 0.5,
+                 priority_limits: Optional[Dict[str, int]] = None):
+        self.path = path or default_state_path()
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.capacity = burst
+        self.daily_limit = daily_limit
+        self.priority_limits = {name: limit for name, limit in (priority_limits or {}).items() if limit}
+        self.lock = threading.Lock()
+        self.fd: Optional[int] = None
+        self.pid: Optional[int] = None
+        self.pending_lock = threading.Lock()
+        self.pending_successes = 0
+        self.pending_retry_after: Optional[float] = None
+        self.pending_refunds: Counter = Counter()
+        self.queue_lock = threading.Lock()
+        self.queues: Dict[str, deque] = {name: deque() for name in PRIORITIES}
+        self.synced = {"floats": [float(burst), time.time(), rate, 0.0],
+                       "counts": [int(time.time() // 86400), 0, 0, 0, 0]}
+
+    def _open(self) -> int:
+        # A forked worker must not share the parent's open file description, or
+        # flock would not exclude the two processes from each other.
+        if self.fd is None or self.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self.pid = os.getpid()
+        return self.fd
+
+    def _update(self, change):
+        with self.lock:
+            fd = self._open()
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                state = self._read(fd)
+                self._apply_pending(state)
+                try:
+                    return change(state)
+                finally:
+                    os.pwrite(fd, struct.pack(STATE_FORMAT, STATE_MAGIC, 1, *state["floats"], *state["counts"]), 0)
+                    self.synced = state
+            finally:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _read(self, fd: int) -> Dict[str, list]:
+        now = time.time()
+        raw = os.pread(fd, STATE_SIZE, 0)
+        if len(raw) == STATE_SIZE:
+            magic, version, *values = struct.unpack(STATE_FORMAT, raw)
+            if magic == STATE_MAGIC and version == 1:
+                floats, counts = list(values[:4]), list(values[4:])
+                tokens, updated, rate, _ = floats
+                floats[0] = min(self.capacity, tokens + max(0.0, now - updated) * rate)
+                floats[1] = now
+                floats[2] = min(rate, self.max_rate)
+                day = int(now // 86400)
+                if counts[0] != day:
+                    counts = [day, 0, 0, 0, 0]
+                return {"floats": floats, "counts": counts}
+        return {"floats": [float(self.capacity), now, self.max_rate, 0.0],
+                "counts": [int(now // 86400), 0, 0, 0, 0]}
+
+    def _apply_pending(self, state: Dict[str, list]):
+        with self.pending_lock:
+            successes, retry_after, refunds = self.pending_successes, self.pending_retry_after, self.pending_refunds
+            self.pending_successes, self.pending_retry_after, self.pending_refunds = 0, None, Counter()
+        floats, counts = state["floats"], state["counts"]
+        for _ in range(min(successes, 64)):
+            floats[2] = min(self.max_rate, floats[2] + 1 / floats[2])
+        if retry_after is not None:
+            if floats[1] - floats[3] >= 1.0:
+                floats[2] = max(self.min_rate, floats[2] / 2)
+                floats[3] = floats[1]
+            if retry_after:
+                floats[0] = min(floats[0], -retry_after * floats[2])
+        for priority, count in refunds.items():
+            index = 2 + PRIORITIES.index(priority)
+            floats[0] = min(self.capacity, floats[0] + count)
+            counts[1] = max(0, counts[1] - count)
+            counts[index] = max(0, counts[index] - count)
+
+    # Takes a token if the class may have one. Returns (taken, seconds to wait): when
+    # taken the caller sleeps off any token debt; otherwise it retries after the wait.
+    def _take(self, priority: Union[str, CallPriority]) -> Tuple[bool, float]:
+        priority = priority_name(priority)
+        reserve = PRIORITY_RESERVE[priority] * self.capacity
+        index = 2 + PRIORITIES.index(priority)
+        class_limit = self.priority_limits.get(priority, 0)
+
+        def change(state):
+            floats, counts = state["floats"], state["counts"]
+            if self.daily_limit and counts[1] >= self.daily_limit:
+                raise QuotaExhausted(f"Daily flight API quota of {self.daily_limit} calls used up")
+            if class_limit and counts[index] >= class_limit:
+                raise QuotaExhausted(f"Daily {priority} quota of {class_limit} calls used up")
+            tokens, rate = floats[0], floats[2]
+            if priority == "interactive" or tokens - 1 >= reserve:
+                floats[0] = tokens - 1
+                counts[1] += 1
+                counts[index] += 1
+                return True, max(0.0, -floats[0] / rate)
+            return False, max(0.01, (reserve + 1 - tokens) / rate)
+
+        return self._update(change)
+
+    # Returns a token taken for a call that was not sent; applied on the next take.
+    def refund(self, priority: Union[str, CallPriority] = "interactive"):
+        with self.pending_lock:
+            self.pending_refunds[priority_name(priority)] += 1
+
+    def _refund_if_taken(self, take: "asyncio.Future", priority: str):
+        if not take.cancelled() and take.exception() is None and take.result()[0]:
+            self.refund(priority)
+
+    # Applies buffered outcomes and reloads the shared state; blocking, so async
+    # callers run it in a thread.
+    def refresh(self):
+        self._update(lambda state: None)
+
+    # Puts the waiter in the queue of the call's current class, or takes it out of any
+    # queue for interactive calls. Returns whether it may try the file now.
+    def _enqueue(self, waiter: _Waiter, name: str) -> bool:
+        with self.queue_lock:
+            if waiter.queue != name:
+                self._dequeue_locked(waiter)
+                if name != "interactive":
+                    self.queues[name].append(waiter)
+                    waiter.queue = name
+            return waiter.queue is None or self.queues[waiter.queue][0] is waiter
+
+    def _leave(self, waiter: _Waiter):
+        with self.queue_lock:
+            self._dequeue_locked(waiter)
+
+    def _dequeue_locked(self, waiter: _Waiter):
+        if waiter.queue is None:
+            return
+        queue = self.queues[waiter.queue]
+        was_head = queue[0] is waiter
+        queue.remove(waiter)
+        waiter.queue = None
+        if was_head and queue:
+            queue[0].wake()
+
+    def _watch(self, priority: Union[str, CallPriority], waiter: _Waiter):
+        if isinstance(priority, CallPriority):
+            priority.listeners.append(waiter.wake)
+
+    def _unwatch(self, priority: Union[str, CallPriority], waiter: _Waiter):
+        if isinstance(priority, CallPriority) and waiter.wake in priority.listeners:
+            priority.listeners.remove(waiter.wake)
+
+    def wait_if_needed(self, priority: Union[str, CallPriority] = "interactive"):
+        waiter = _Waiter()
+        self._watch(priority, waiter)
+        try:
+            while True:
+                if not self._enqueue(waiter, priority_name(priority)):
+                    waiter.block()
+                    continue
+                taken, wait = self._take(priority)
+                if taken:
+                    self._leave(waiter)
+                    if wait > 0:
+                        time.sleep(wait)
+                    return
+                waiter.block(wait)
+        finally:
+            self._leave(waiter)
+            self._unwatch(priority, waiter)
+
+    async def acquire(self, priority: Union[str, CallPriority] = "interactive"):
+        waiter = _Waiter(asyncio.get_running_loop())
+        self._watch(priority, waiter)
+        try:
+            while True:
+                name = priority_name(priority)
+                if not self._enqueue(waiter, name):
+                    await waiter.wait()
+                    continue
+                take = asyncio.ensure_future(asyncio.to_thread(self._take, priority))
+                try:
+                    taken, wait = await asyncio.shield(take)
+                except asyncio.CancelledError:
+                    take.add_done_callback(lambda done: self._refund_if_taken(done, name))
+                    raise
+                if not taken:
+                    await waiter.wait(wait)
+                    continue
+                self._leave(waiter)
+                if wait > 0:
+                    try:
+                        await asyncio.sleep(wait)
+                    except asyncio.CancelledError:
+                        self.refund(name)
+                        raise
+                return
+        finally:
+            self._leave(waiter)
+            self._unwatch(priority, waiter)
+
+    def record_throttle(self, retry_after: Optional[float] = None):
+        with self.pending_lock:
+            self.pending_retry_after = max(self.pending_retry_after or 0.0, retry_after or 0.0)
+
+    def record_success(self):
+        with self.pending_lock:
+            self.pending_successes += 1
+
+    def available(self) -> float:
+        floats = self.synced["floats"]
+        return min(self.capacity, floats[0] + max(0.0, time.time() - floats[1]) * floats[2])
+
+    # Calls this UTC day across every process, as of the last take or refresh().
+    def used_today(self, priority: Optional[str] = None) -> int:
+        counts = self.synced["counts"]
+        if counts[0] != int(time.time() // 86400):
+            return 0
+        return counts[1] if priority is None else counts[2 + PRIORITIES.index(priority)]
+
+    @property
+    def rate(self) -> float:
+        return self.synced["floats"][2]
+
+    def stats(self) -> Dict[str, object]:
+        floats, counts = self.synced["floats"], self.synced["counts"]
+        if counts[0] != int(time.time() // 86400):
+            counts = [counts[0], 0, 0, 0, 0]
+        return {
+            "tokens": round(self.available(), 3),
+            "rate": round(floats[2], 3),
+            "max_rate": self.max_rate,
+            "capacity": self.capacity,
+            "used_today": counts[1],
+            "daily_limit": self.daily_limit or None,
+            "remaining_today": max(0, self.daily_limit - counts[1]) if self.daily_limit else None,
+            "used_today_by_priority": dict(zip(PRIORITIES, counts[2:])),
+            "priority_limits": self.priority_limits or None
+        }
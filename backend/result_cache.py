@@ -0,0 +1,94 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+class TripKey(NamedTuple):
+    start_iata: str
+    end_iata: str
+    middle: Tuple[Tuple[str, int], ...]
+    start_date: str
+    end_date: str
+    adults: int
+    children: int
+    infants: int
+    engine: str
+    date_flex: int
+
+# The optimizer tries every visiting order, so the order middle cities were entered in
+# does not change the answer; cities are identified by resolved IATA code so "Paris"
+# and "paris " share an entry.
+def trip_key(start_city: str, end_city: str, middle_cities: List[Dict[str, Any]],
+             start_date: str, end_date: str, adults: int, children: int, infants: int,
+             engine: str, date_flex: int, resolve: Callable[[str], str]) -> TripKey:
+    middle = tuple(sorted((resolve(city["name"].strip()), int(city["days"])) for city in middle_cities))
+    return TripKey(resolve(start_city.strip()), resolve(end_city.strip()), middle, start_date, end_date,
+                   adults, children, infants, engine, date_flex)
+
+class CachedResult(NamedTuple):
+    body: bytes
+    etag: str
+    expires_at: float
+
+# Bounded LRU of encoded /optimize responses. Entries keep the JSON body ready to send
+# and a content hash as the ETag, so a repeat request costs one dict lookup.
+class ResultCache:
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[TripKey, CachedResult]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: TripKey) -> Optional[CachedResult]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires_at <= time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: TripKey, payload: Dict[str, Any], ttl: Optional[float] = None) -> CachedResult:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        entry = CachedResult(body, etag, time.time() + (self.ttl if ttl is None else ttl))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def record_not_modified(self):
+        with self.lock:
+            self.not_modified += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "not_modified": self.not_modified,
+                "size": len(self.entries),
+                "max_entries": self.max_entries
+            }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
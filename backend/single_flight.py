@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# Collapses concurrent calls for the same key into one: the first caller runs the
+# function and everyone who asks for that key while it is in flight gets its result.
+# A caller may pass a `context` the function reads while it runs (such as its
+# priority); a joiner's context is merged into the leader's with join().
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Tuple[Future, Any]] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], context: Any = None) -> Any:
+        with self.lock:
+            entry = self.calls.get(key)
+            leader = entry is None
+            if leader:
+                future = Future()
+                self.calls[key] = (future, context)
+                self.leaders += 1
+            else:
+                future = entry[0]
+                _join(entry[1], context)
+                self.coalesced += 1
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self.calls)}
+
+# The shared call runs as its own task, so a cancelled caller does not cancel it for the
+# others; it is only cancelled once every caller waiting on it has gone away.
+class AsyncSingleFlight:
+    def __init__(self):
+        self.calls: Dict[Hashable, list] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], context: Any = None) -> Any:
+        entry = self.calls.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(fn()), 0, context]
+            self.calls[key] = entry
+            self.leaders += 1
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+        else:
+            _join(entry[2], context)
+            self.coalesced += 1
+        
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                # Forget it first, so a caller arriving before the task has finished
+                # cancelling starts a fresh call instead of joining a cancelled one.
+                self._forget(key, entry)
+                entry[0].cancel()
+
+    def _forget(self, key: Hashable, entry: list):
+        if self.calls.get(key) is entry:
+            del self.calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self.calls)}
+
+def _join(shared: Any, context: Any):
+    if shared is not None and context is not None:
+        shared.join(context)
+
+price_flights = SingleFlight()
+async_price_flights = AsyncSingleFlight()
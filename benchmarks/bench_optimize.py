@@ -0,0 +1,141 @@
+"""Offline /optimize benchmark against the flight API replay stub.
+
+Drives the FastAPI app in-process with 2-12 middle cities at several concurrency
+levels and reports latency percentiles, upstream call counts and cache hit rates:
+
+    python -m benchmarks.bench_optimize --cities 2,4,6 --concurrency 1,4,16
+    python -m benchmarks.bench_optimize --recording flights.jsonl --rate 10 --rate-429 0.05
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from typing import Dict, List
+
+CITY_POOL = [
+    "Paris", "Rome", "Berlin", "Madrid", "Vienna", "Prague", "Lisbon", "Dublin",
+    "Athens", "Oslo", "Warsaw", "Budapest", "Amsterdam", "Brussels", "Copenhagen", "Stockholm"
+]
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cities", default="2,4,6,8", help="comma-separated middle-city counts (2-12)")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrent request counts")
+    parser.add_argument("--requests", type=int, default=16, help="requests per scenario")
+    parser.add_argument("--engine", default="dp", choices=["dp", "bnb", "permutations"])
+    parser.add_argument("--recording", default="", help="JSONL recording to replay; synthetic fares otherwise")
+    parser.add_argument("--latency", type=float, default=0.3, help="simulated upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="uniform latency jitter in seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of upstream calls answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered with 500")
+    parser.add_argument("--rate", type=float, default=200.0,
+                        help="upstream requests per second allowed by the limiter (production uses 10)")
+    parser.add_argument("--distinct-trips", type=int, default=4,
+                        help="distinct trips per scenario; repeats exercise caching and coalescing")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args(argv)
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def make_trips(count: int, num_cities: int, rng: random.Random) -> List[Dict]:
+    trips = []
+    for _ in range(count):
+        cities = rng.sample(CITY_POOL, num_cities)
+        middle = [{"name": city, "days": rng.randint(1, 4)} for city in cities]
+        total_days = sum(city["days"] for city in middle)
+        start_date = date(2026, 3, 1) + timedelta(days=rng.randint(0, 60))
+        trips.append({
+            "start_city": "London",
+            "end_city": "London",
+            "middle_cities": middle,
+            "total_days": total_days,
+            "start_date": start_date.isoformat(),
+            "end_date": (start_date + timedelta(days=total_days)).isoformat(),
+            "adults": 1
+        })
+    return trips
+
+async def run_scenario(main, args: argparse.Namespace, num_cities: int, concurrency: int) -> Dict:
+    import httpx
+    from backend.algorithm import AsyncRateLimiter
+    from backend.circuit_breaker import CircuitBreaker
+    from backend.price_cache import MemoryPriceCache
+
+    main.price_cache = MemoryPriceCache()
+    main.async_rate_limiter = AsyncRateLimiter(rate=args.rate, burst=max(1, int(args.rate)))
+    main.circuit_breaker = CircuitBreaker()
+    main.result_cache.clear()
+    main.flight_replay.reset_stats()
+    coalesced_before = main.async_price_flights.coalesced
+
+    rng = random.Random(args.seed + num_cities)
+    trips = make_trips(args.distinct_trips, num_cities, rng)
+    bodies = [dict(trips[i % len(trips)], engine=args.engine) for i in range(args.requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app),
+                                 base_url="http://bench", timeout=None) as client:
+        async def one(body: Dict):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/optimize", json=body)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(body) for body in bodies))
+        wall = time.perf_counter() - started
+
+    cache = main.price_cache.stats()
+    upstream = main.flight_replay.stats()
+    return {
+        "cities": num_cities,
+        "concurrency": concurrency,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "wall": wall,
+        "upstream": upstream["calls"],
+        "upstream_429": upstream["statuses"].get(429, 0),
+        "hit_rate": cache["hit_rate"],
+        "coalesced": main.async_price_flights.coalesced - coalesced_before,
+        "failures": failures
+    }
+
+async def run(args: argparse.Namespace):
+    os.environ["FLIGHT_API_REPLAY"] = args.recording or os.devnull
+    os.environ["FLIGHT_API_REPLAY_LATENCY"] = str(args.latency)
+    os.environ["FLIGHT_API_REPLAY_JITTER"] = str(args.jitter)
+    os.environ["FLIGHT_API_REPLAY_429_RATE"] = str(args.rate_429)
+    os.environ["FLIGHT_API_REPLAY_ERROR_RATE"] = str(args.error_rate)
+    os.environ["TRIP_LOG_PATH"] = ""
+    # Replayed runs must not draw on the host-wide quota a live server is using.
+    os.environ["FLIGHT_API_QUOTA"] = "0"
+    import main
+
+    header = f"{'cities':>6} {'conc':>5} {'p50 s':>8} {'p95 s':>8} {'wall s':>8} {'upstream':>9} {'429s':>5} {'hit rate':>9} {'coalesced':>10} {'fail':>5}"
+    print(header)
+    print("-" * len(header))
+    for num_cities in [int(value) for value in args.cities.split(",")]:
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            result = await run_scenario(main, args, num_cities, concurrency)
+            print(f"{result['cities']:>6} {result['concurrency']:>5} {result['p50']:>8.3f} {result['p95']:>8.3f} "
+                  f"{result['wall']:>8.2f} {result['upstream']:>9} {result['upstream_429']:>5} "
+                  f"{result['hit_rate']:>9.1%} {result['coalesced']:>10} {result['failures']:>5}")
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(parse_args(sys.argv[1:])))
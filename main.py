@@ -1,13 +1,28 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from backend.algorithm import RouteOptimizer
+from backend.algorithm import RouteOptimizer, AsyncRateLimiter, DistancePriceBound, RateLimiter
+from backend.circuit_breaker import CircuitBreaker
+from backend.quota import SharedTokenBucket
+from backend.http_client import create_http_session, create_async_http_client
+from backend.price_cache import MemoryPriceCache, SQLitePriceCache
+from backend.single_flight import price_flights, async_price_flights
+from backend.batch import optimize_batch
+from backend.cache_warmer import CacheWarmer, TripLog
+from backend.result_cache import CachedResult, ResultCache, TripKey, etag_matches, trip_key
+from backend.metrics import gauge_values, optimize_seconds, registry
+from backend.flight_replay import FlightRecorder, FlightReplay, RecordingAdapter, RecordingTransport, ReplayAdapter, ReplayTransport
 from backend.flight_routes import router as flight_router
 from backend.iata_lookup import iata_lookup  
 from backend.final_city import router as city_router
@@ -17,9 +32,118 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000")
+OPTIMIZE_TIMEOUT = float(os.environ.get("OPTIMIZE_TIMEOUT", 120))
+
+# FLIGHT_API_REPLAY serves searchFlights from a recording (plus synthetic fares) instead
+# of RapidAPI; FLIGHT_API_RECORD captures live responses into such a recording.
+FLIGHT_API_REPLAY = os.environ.get("FLIGHT_API_REPLAY")
+FLIGHT_API_RECORD = os.environ.get("FLIGHT_API_RECORD")
+
+flight_replay = None
+if FLIGHT_API_REPLAY:
+    flight_replay = FlightReplay.from_file(
+        FLIGHT_API_REPLAY,
+        latency=float(os.environ.get("FLIGHT_API_REPLAY_LATENCY", 0.3)),
+        latency_jitter=float(os.environ.get("FLIGHT_API_REPLAY_JITTER", 0.1)),
+        rate_limit_ratio=float(os.environ.get("FLIGHT_API_REPLAY_429_RATE", 0.0)),
+        error_ratio=float(os.environ.get("FLIGHT_API_REPLAY_ERROR_RATE", 0.0))
+    )
+    http_session = create_http_session(adapter=ReplayAdapter(flight_replay))
+    async_http_client = create_async_http_client(transport=ReplayTransport(flight_replay))
+elif FLIGHT_API_RECORD:
+    flight_recorder = FlightRecorder(FLIGHT_API_RECORD)
+    http_session = create_http_session(adapter=RecordingAdapter(flight_recorder, pool_connections=16, pool_maxsize=16))
+    async_http_client = create_async_http_client(transport=RecordingTransport(flight_recorder))
+else:
+    http_session = create_http_session()
+    async_http_client = create_async_http_client()
+# By default every worker process on the host draws from one shared token bucket, so
+# the upstream rate limit and daily quota hold however many workers run. Set
+# FLIGHT_API_QUOTA=0 to fall back to per-process limiters.
+FLIGHT_API_RATE = float(os.environ.get("FLIGHT_API_RATE", 10))
+FLIGHT_API_BURST = int(os.environ.get("FLIGHT_API_BURST", 10))
+# Daily allowance for the cache warmer's prefetches, shared by every worker's warmer.
+CACHE_WARMER_DAILY_QUOTA = int(os.environ.get("CACHE_WARMER_DAILY_QUOTA", 500))
+if os.environ.get("FLIGHT_API_QUOTA", "1") != "0":
+    flight_api_quota = SharedTokenBucket(
+        path=os.environ.get("FLIGHT_API_QUOTA_PATH") or None,
+        rate=FLIGHT_API_RATE,
+        burst=FLIGHT_API_BURST,
+        daily_limit=int(os.environ.get("FLIGHT_API_DAILY_LIMIT", 0)),
+        priority_limits={"prefetch": CACHE_WARMER_DAILY_QUOTA}
+    )
+    async_rate_limiter = rate_limiter = flight_api_quota
+else:
+    flight_api_quota = None
+    async_rate_limiter = AsyncRateLimiter(rate=FLIGHT_API_RATE, burst=FLIGHT_API_BURST)
+    rate_limiter = RateLimiter(max_requests=FLIGHT_API_BURST, time_window=FLIGHT_API_BURST / FLIGHT_API_RATE)
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("FLIGHT_API_BREAKER_THRESHOLD", 5)),
+    reset_timeout=float(os.environ.get("FLIGHT_API_BREAKER_RESET", 30))
+)
+# The bound starts from these loose values and recalibrates from priced legs unless
+# PRICE_BOUND_CALIBRATE=0.
+price_bound = DistancePriceBound(
+    per_km=float(os.environ.get("PRICE_BOUND_PER_KM", 0.01)),
+    floor=float(os.environ.get("PRICE_BOUND_FLOOR", 0.0)),
+    calibrate=os.environ.get("PRICE_BOUND_CALIBRATE", "1") != "0"
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmer_task = asyncio.create_task(cache_warmer.run()) if cache_warmer else None
+    yield
+    if warmer_task:
+        warmer_task.cancel()
+        try:
+            await warmer_task
+        except asyncio.CancelledError:
+            pass
+    await async_http_client.aclose()
+    http_session.close()
+
+app = FastAPI(lifespan=lifespan)
+
+PRICE_CACHE_PATH = os.environ.get("PRICE_CACHE_PATH")
+PRICE_CACHE_TTL = float(os.environ.get("PRICE_CACHE_TTL", 3600))
+PRICE_CACHE_MAX_ENTRIES = int(os.environ.get("PRICE_CACHE_MAX_ENTRIES", 50000))
+PRICE_CACHE_NEGATIVE_TTL = float(os.environ.get("PRICE_CACHE_NEGATIVE_TTL", 300))
+
+if PRICE_CACHE_PATH:
+    price_cache = SQLitePriceCache(PRICE_CACHE_PATH, ttl=PRICE_CACHE_TTL, max_entries=PRICE_CACHE_MAX_ENTRIES,
+                                   negative_ttl=PRICE_CACHE_NEGATIVE_TTL)
+else:
+    price_cache = MemoryPriceCache(ttl=PRICE_CACHE_TTL, max_entries=PRICE_CACHE_MAX_ENTRIES,
+                                   negative_ttl=PRICE_CACHE_NEGATIVE_TTL)
+
+def build_optimizer(adults: int = 1, children: int = 0, infants: int = 0,
+                    priority: str = "interactive") -> RouteOptimizer:
+    return RouteOptimizer(adults=adults, children=children, infants=infants,
+                          session=http_session, price_cache=price_cache,
+                          http_client=async_http_client, async_rate_limiter=async_rate_limiter,
+                          price_bound=price_bound, rate_limiter=rate_limiter,
+                          circuit_breaker=circuit_breaker, priority=priority)
+
+def build_prefetch_optimizer(adults: int, children: int, infants: int) -> RouteOptimizer:
+    return build_optimizer(adults, children, infants, priority="prefetch")
+
+# TRIP_LOG_PATH collects anonymised trips (set it empty to disable); the cache warmer
+# mines it for popular legs and refreshes them with spare upstream capacity.
+TRIP_LOG_PATH = os.environ.get("TRIP_LOG_PATH", "requests.jsonl")
+trip_log = TripLog(TRIP_LOG_PATH) if TRIP_LOG_PATH else None
+cache_warmer = None
+if trip_log and os.environ.get("CACHE_WARMER", "1") != "0":
+    cache_warmer = CacheWarmer(
+        trip_log, build_prefetch_optimizer, price_cache, async_rate_limiter, circuit_breaker,
+        daily_quota=CACHE_WARMER_DAILY_QUOTA,
+        interval=float(os.environ.get("CACHE_WARMER_INTERVAL", 30)),
+        top_legs=int(os.environ.get("CACHE_WARMER_TOP_LEGS", 200))
+    )
+
+# Whole-trip results expire with the prices they were computed from.
+result_cache = ResultCache(ttl=PRICE_CACHE_TTL,
+                           max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 1000)))
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +151,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Result-Cache"],
 )
 
 
@@ -45,42 +170,270 @@ class TripRequest(BaseModel):
     adults: int = 1
     children: int = 0
     infants: int = 0
+    timeout_seconds: Optional[float] = None
+    engine: Literal["dp", "bnb", "permutations"] = "dp"
+    date_flex: int = Field(0, ge=0, le=3)
+    deadline_ms: Optional[int] = Field(None, ge=50, le=600000)
+
+class BatchRequest(BaseModel):
+    trips: List[TripRequest] = Field(..., min_length=1, max_length=100)
+    timeout_seconds: Optional[float] = None
+
+async def run_until_disconnected(request: Request, coro, timeout: float):
+    """Run a coroutine, cancelling it on timeout or when the client goes away"""
+    task = asyncio.ensure_future(asyncio.wait_for(coro, timeout=timeout))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=0.5)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
 
 app.include_router(flight_router)
 app.include_router(city_router)
 
+def trip_cache_key(trip: TripRequest) -> TripKey:
+    return trip_key(trip.start_city, trip.end_city, [city.model_dump() for city in trip.middle_cities],
+                    trip.start_date, trip.end_date, trip.adults, trip.children, trip.infants,
+                    trip.engine, trip.date_flex, iata_lookup.get_iata_code)
+
+def cached_response(entry: CachedResult, if_none_match: Optional[str], cache_status: str) -> Response:
+    headers = {"ETag": entry.etag, "X-Result-Cache": cache_status,
+               "Cache-Control": f"private, max-age={max(0, int(entry.expires_at - time.time()))}"}
+    if etag_matches(if_none_match, entry.etag):
+        result_cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
 @app.post("/optimize")
-async def optimize_route(trip: TripRequest):
+async def optimize_route(trip: TripRequest, request: Request, debug: Optional[str] = None):
+    started = time.perf_counter()
+    outcome = "error"
     try:
         logger.info(f" Received trip request: {trip}")
+        if trip.deadline_ms is not None and trip.date_flex > 0:
+            raise HTTPException(status_code=400, detail="deadline_ms is not supported together with date_flex")
+        cache_key = trip_cache_key(trip)
+        if trip_log:
+            await asyncio.to_thread(trip_log.append, cache_key)
+        if_none_match = request.headers.get("if-none-match")
+        if debug != "timing":
+            entry = result_cache.get(cache_key)
+            if entry is not None:
+                outcome = "cached"
+                return cached_response(entry, if_none_match, "hit")
+        
         middle_cities_dict = [{"name": city.name, "days": city.days} for city in trip.middle_cities]
-        optimizer = RouteOptimizer(adults=trip.adults, children=trip.children, infants=trip.infants)
-        optimal_routes = optimizer.find_optimal_routes(
+        optimizer = build_optimizer(trip.adults, trip.children, trip.infants)
+        optimal_routes = await run_until_disconnected(
+            request,
+            optimizer.find_optimal_routes_async(
+                start_city=trip.start_city,
+                end_city=trip.end_city,
+                middle_cities=middle_cities_dict,
+                start_date=trip.start_date,
+                end_date=trip.end_date,
+                num_results=3,
+                engine=trip.engine,
+                date_flex=trip.date_flex,
+                deadline_ms=trip.deadline_ms
+            ),
+            timeout=trip.timeout_seconds or OPTIMIZE_TIMEOUT
+        )
+        outcome = "success"
+        proven_optimal = optimizer.search_stats.get("proven_optimal", True)
+        if not optimal_routes:
+            response = {"status": "success", "message": "No routes found", "routes": [],
+                        "proven_optimal": proven_optimal, "search_stats": optimizer.search_stats}
+        else:
+            response = {"status": "success", "count": len(optimal_routes), "routes": optimal_routes,
+                        "proven_optimal": proven_optimal, "search_stats": optimizer.search_stats}
+        
+        # Deadline-bound answers that are not proven optimal are never cached. Others
+        # live only as long as the shortest-lived price they were computed from, so a
+        # result that relied on a failed or no-flights leg is recomputed soon.
+        entry = None
+        ttl = min(result_cache.ttl, optimizer.prices_valid_until - time.time())
+        if proven_optimal and ttl >= 1:
+            entry = result_cache.set(cache_key, response, ttl=ttl)
+        if debug == "timing":
+            response["timing"] = optimizer.timings.as_dict()
+        if entry is None or debug == "timing":
+            return response
+        return cached_response(entry, if_none_match, "miss")
+    except HTTPException as e:
+        outcome = "disconnected" if e.status_code == 499 else "error"
+        raise
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logger.warning("Route optimization timed out")
+        raise HTTPException(status_code=504, detail="Optimization timed out")
+    except Exception as e:
+        logger.error(f"Error optimizing route: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+    finally:
+        optimize_seconds.observe(time.perf_counter() - started, endpoint="optimize", outcome=outcome)
+
+@app.post("/optimize/batch")
+async def optimize_batch_route(batch: BatchRequest, request: Request):
+    """Optimize many trips at once, fetching each distinct leg only once"""
+    for index, trip in enumerate(batch.trips):
+        if trip.engine != "dp":
+            raise HTTPException(status_code=400,
+                                detail=f"trips[{index}]: engine '{trip.engine}' is not supported by /optimize/batch")
+        if trip.deadline_ms is not None:
+            raise HTTPException(status_code=400,
+                                detail=f"trips[{index}]: deadline_ms is not supported by /optimize/batch; use timeout_seconds")
+    started = time.perf_counter()
+    outcome = "error"
+    
+    def make_optimizer(trip: Dict[str, Any]) -> RouteOptimizer:
+        return build_optimizer(trip["adults"], trip["children"], trip["infants"], priority="batch")
+    
+    try:
+        logger.info(f" Received batch of {len(batch.trips)} trips")
+        if trip_log:
+            await asyncio.to_thread(trip_log.append, *[trip_cache_key(trip) for trip in batch.trips])
+        results, stats = await run_until_disconnected(
+            request,
+            optimize_batch([trip.model_dump() for trip in batch.trips], make_optimizer, num_results=3),
+            timeout=batch.timeout_seconds or OPTIMIZE_TIMEOUT
+        )
+        outcome = "success"
+        return {"status": "success", "count": len(results), "results": results, "batch_stats": stats}
+    except HTTPException as e:
+        outcome = "disconnected" if e.status_code == 499 else "error"
+        raise
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logger.warning("Batch optimization timed out")
+        raise HTTPException(status_code=504, detail="Optimization timed out")
+    except Exception as e:
+        logger.error(f"Error optimizing batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+    finally:
+        optimize_seconds.observe(time.perf_counter() - started, endpoint="optimize_batch", outcome=outcome)
+
+# The stream always runs the subset DP (the flexible-date DP with date_flex), so it
+# rejects other engines and deadline_ms rather than silently ignoring them.
+@app.post("/optimize/stream")
+async def optimize_route_stream(trip: TripRequest):
+    """Stream optimization progress and best-so-far routes as NDJSON"""
+    logger.info(f" Received streaming trip request: {trip}")
+    if trip.engine != "dp":
+        raise HTTPException(status_code=400, detail=f"engine '{trip.engine}' is not supported by /optimize/stream")
+    if trip.deadline_ms is not None:
+        raise HTTPException(status_code=400,
+                            detail="deadline_ms is not supported by /optimize/stream; use timeout_seconds")
+    if trip_log:
+        await asyncio.to_thread(trip_log.append, trip_cache_key(trip))
+    middle_cities_dict = [{"name": city.name, "days": city.days} for city in trip.middle_cities]
+    optimizer = build_optimizer(trip.adults, trip.children, trip.infants)
+    
+    async def events():
+        started = time.perf_counter()
+        outcome = "success"
+        stream = optimizer.stream_optimal_routes(
             start_city=trip.start_city,
             end_city=trip.end_city,
             middle_cities=middle_cities_dict,
             start_date=trip.start_date,
             end_date=trip.end_date,
-            num_results=3
+            num_results=3,
+            date_flex=trip.date_flex,
+            timeout=trip.timeout_seconds or OPTIMIZE_TIMEOUT
         )
-        if not optimal_routes:
-            return {"status": "success", "message": "No routes found", "routes": []}
-        return {"status": "success", "count": len(optimal_routes), "routes": optimal_routes}
-    except Exception as e:
-        logger.error(f"Error optimizing route: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+        try:
+            async for event in stream:
+                if event["type"] == "error":
+                    outcome = "timeout"
+                yield json.dumps(event) + "\n"
+        except asyncio.CancelledError:
+            outcome = "disconnected"
+            raise
+        except Exception as e:
+            outcome = "error"
+            logger.error(f"Error streaming route optimization: {str(e)}")
+            yield json.dumps({"type": "error", "detail": f"Optimization failed: {str(e)}"}) + "\n"
+        finally:
+            await stream.aclose()
+            optimize_seconds.observe(time.perf_counter() - started, endpoint="optimize_stream", outcome=outcome)
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "Travel Route Optimizer"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Get flight price cache and request coalescing statistics"""
+    if flight_api_quota:
+        await asyncio.to_thread(flight_api_quota.refresh)
+    return {
+        **await asyncio.to_thread(price_cache.stats),
+        "result_cache": result_cache.stats(),
+        "single_flight": {
+            "threaded": price_flights.stats(),
+            "async": async_price_flights.stats(),
+            "coalesced": price_flights.coalesced + async_price_flights.coalesced
+        },
+        "circuit_breaker": circuit_breaker.stats(),
+        "price_bound": price_bound.stats(),
+        "cache_warmer": cache_warmer.stats() if cache_warmer else None,
+        "rate_limits": {"threaded": rate_limiter.rate, "async": async_rate_limiter.rate},
+        "quota": flight_api_quota.stats() if flight_api_quota else None
+    }
+
+registry.gauge("price_cache_entries", "Flight prices currently cached",
+               lambda: gauge_values(({}, price_cache.stats()["size"])))
+registry.gauge("price_cache_requests", "Price cache lookups since start, by result",
+               lambda: gauge_values(*(({"result": result}, price_cache.stats()[result])
+                                      for result in ("hits", "misses", "evictions"))))
+registry.gauge("single_flight_calls", "Leg lookups since start that led or joined an in-flight fetch",
+               lambda: gauge_values(*(({"mode": mode, "role": role}, stats[role])
+                                      for mode, stats in (("threaded", price_flights.stats()),
+                                                          ("async", async_price_flights.stats()))
+                                      for role in ("leaders", "coalesced"))))
+
+registry.gauge("flight_api_circuit_open", "1 while the flight API circuit breaker is open or probing",
+               lambda: gauge_values(({}, float(circuit_breaker.stats()["state"] != CircuitBreaker.CLOSED))))
+registry.gauge("flight_api_rate_limit", "Current adaptive upstream request rate per second, by limiter",
+               lambda: gauge_values(({"limiter": "threaded"}, rate_limiter.rate),
+                                    ({"limiter": "async"}, async_rate_limiter.rate)))
+
+def quota_remaining() -> Dict:
+    remaining = flight_api_quota.stats()["remaining_today"] if flight_api_quota else None
+    return gauge_values(({}, remaining)) if remaining is not None else {}
+
+def quota_used() -> Dict:
+    used = flight_api_quota.stats()["used_today_by_priority"] if flight_api_quota else {}
+    return gauge_values(*(({"priority": priority}, count) for priority, count in used.items()))
+
+registry.gauge("flight_api_quota_remaining", "Upstream calls left today under FLIGHT_API_DAILY_LIMIT", quota_remaining)
+registry.gauge("flight_api_quota_used", "Upstream calls made today across all workers, by priority class", quota_used)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics in the text exposition format"""
+    if flight_api_quota:
+        await asyncio.to_thread(flight_api_quota.refresh)
+    body = await asyncio.to_thread(registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 @app.get("/iata")
 async def get_iata(city: str, strategy: str = "largest"):
     """Get IATA code for a city"""
-    iata = iata_lookup.get_iata_for_city(city, strategy=strategy)
-    if not iata:
+    resolution = iata_lookup.resolve(city, strategy=strategy)
+    if not resolution.exact:
         raise HTTPException(status_code=404, detail=f"No IATA code found for city: {city}")
-    return {"city": city.title(), "iata": iata}
+    return {"city": city.title(), "iata": resolution.iata, "matched_by": resolution.matched_by,
+            "ambiguous": resolution.ambiguous, "alternatives": list(resolution.alternatives)}
 
 @app.get("/airports")
 async def get_airports(city: str):
@@ -90,6 +443,16 @@ async def get_airports(city: str):
         raise HTTPException(status_code=404, detail=f"No airports found for city: {city}")
     return {"city": city.title(), "airports": airports}
 
+@app.get("/airports/nearby")
+async def get_nearby_airports(lat: float, lon: float, limit: int = 5, radius_km: Optional[float] = None):
+    """Get the airports closest to a coordinate, optionally within a radius"""
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise HTTPException(status_code=400, detail="Latitude must be within ±90 and longitude within ±180")
+    airports = iata_lookup.get_nearby_airports(lat, lon, k=max(1, min(limit, 50)), radius_km=radius_km)
+    if not airports:
+        raise HTTPException(status_code=404, detail=f"No airports found near ({lat}, {lon})")
+    return {"latitude": lat, "longitude": lon, "airports": airports}
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,53 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+# main.py wires its globals from the environment at import time: keep the tests off the
+# trip log, the host-wide quota file, the cache warmer and the real flight API.
+os.environ.update(TRIP_LOG_PATH="", CACHE_WARMER="0", FLIGHT_API_QUOTA="0",
+                  FLIGHT_API_REPLAY=os.devnull, FLIGHT_API_REPLAY_LATENCY="0")
+
+from fastapi.testclient import TestClient
+
+import main
+from backend.algorithm import AsyncRateLimiter, RouteOptimizer
+from backend.price_cache import MemoryPriceCache
+from backend.result_cache import ResultCache
+
+# Deterministic stand-in for the flight API: every (from, to, date) leg gets a fixed
+# price, and roughly one leg in ten has no flights at all.
+def fake_price(from_iata: str, to_iata: str, date: str) -> float:
+    digest = int(hashlib.md5(f"{from_iata}{to_iata}{date}".encode()).hexdigest(), 16)
+    return 0.0 if digest % 10 == 0 else float(20 + digest % 300)
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    def fetch(self, cache_key, priority):
+        return fake_price(cache_key.from_iata, cache_key.to_iata, cache_key.date)
+
+    async def fetch_async(self, cache_key, priority):
+        return fetch(self, cache_key, priority)
+
+    monkeypatch.setattr(RouteOptimizer, "_fetch_flight_price", fetch)
+    monkeypatch.setattr(RouteOptimizer, "_fetch_flight_price_async", fetch_async)
+
+# Fetches that take `delay` seconds each, so deadline-bound searches run out of time.
+@pytest.fixture
+def slow_api(monkeypatch):
+    def install(delay: float):
+        async def fetch_async(self, cache_key, priority):
+            await asyncio.sleep(delay)
+            return fake_price(cache_key.from_iata, cache_key.to_iata, cache_key.date)
+
+        monkeypatch.setattr(RouteOptimizer, "_fetch_flight_price_async", fetch_async)
+    return install
+
+# A client over fresh price and result caches and an upstream limiter that never waits.
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "price_cache", MemoryPriceCache())
+    monkeypatch.setattr(main, "result_cache", ResultCache())
+    monkeypatch.setattr(main, "async_rate_limiter", AsyncRateLimiter(rate=10000.0, burst=10000))
+    return TestClient(main.app)
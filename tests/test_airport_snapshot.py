@@ -0,0 +1,47 @@
+import os
+import random
+
+import pytest
+
+from backend.iata_lookup import IATALookup
+
+CSV_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "airports.csv")
+
+# One lookup built straight from the CSV and one mapped from the snapshot that a first
+# load wrote, so every answer below is compared across the two paths.
+@pytest.fixture(scope="module")
+def lookups(tmp_path_factory):
+    snapshot_file = str(tmp_path_factory.mktemp("snapshot") / "airports.snapshot")
+    parsed = IATALookup(CSV_FILE, snapshot_file=None)
+    IATALookup(CSV_FILE, snapshot_file=snapshot_file).ensure_loaded()
+    assert os.path.exists(snapshot_file)
+    mapped = IATALookup(CSV_FILE, snapshot_file=snapshot_file)
+    mapped.ensure_loaded()
+    assert isinstance(mapped.sections["search_rank"], memoryview)
+    return parsed, mapped
+
+def sample_queries(lookup: IATALookup):
+    rng = random.Random(5)
+    cities = rng.sample(sorted(lookup.get_all_cities()), 150)
+    codes = rng.sample(sorted(lookup.airports), 150)
+    prefixes = [city[:length] for city in cities[:50] for length in (1, 2, 3, 5)]
+    return cities + codes + prefixes + ["LON", "PAR", "new york", "  paris ", "Xyzzy", "", "sao"]
+
+def test_snapshot_answers_match_the_csv(lookups):
+    parsed, mapped = lookups
+    assert mapped.get_airport_count() == parsed.get_airport_count()
+    assert mapped.get_city_count() == parsed.get_city_count()
+    for query in sample_queries(parsed):
+        assert mapped.resolve(query) == parsed.resolve(query), query
+        assert mapped.search_airports(query) == parsed.search_airports(query), query
+        assert mapped.get_airports_by_city(query) == parsed.get_airports_by_city(query), query
+
+def test_snapshot_distances_match_the_csv(lookups):
+    parsed, mapped = lookups
+    rng = random.Random(9)
+    codes = rng.sample(sorted(parsed.airports), 60)
+    for from_iata, to_iata in zip(codes, reversed(codes)):
+        assert mapped.get_distance_km(from_iata, to_iata) == parsed.get_distance_km(from_iata, to_iata)
+    for _ in range(20):
+        lat, lon = rng.uniform(-60, 70), rng.uniform(-180, 180)
+        assert mapped.get_nearby_airports(lat, lon, k=5) == parsed.get_nearby_airports(lat, lon, k=5)
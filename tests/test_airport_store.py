@@ -0,0 +1,61 @@
+import math
+import random
+from array import array
+
+import pytest
+
+from backend.airport_store import SpatialIndex, haversine_km
+
+# Random points, denser near the poles and the antimeridian than a uniform draw, plus a
+# row without coordinates that must never be returned.
+def random_points(rng: random.Random, count: int):
+    latitudes, longitudes = array("d"), array("d")
+    for _ in range(count):
+        latitudes.append(rng.choice([rng.uniform(-90, 90), rng.uniform(80, 90), rng.uniform(-90, -80)]))
+        longitudes.append(rng.choice([rng.uniform(-180, 180), rng.uniform(175, 180), rng.uniform(-180, -175)]))
+    latitudes.append(math.nan)
+    longitudes.append(math.nan)
+    return latitudes, longitudes
+
+def brute_force(latitudes, longitudes, lat: float, lon: float):
+    return sorted((haversine_km(lat, lon, row_lat, row_lon), row_id)
+                  for row_id, (row_lat, row_lon) in enumerate(zip(latitudes, longitudes))
+                  if not math.isnan(row_lat))
+
+@pytest.mark.parametrize("seed", range(4))
+def test_nearest_matches_brute_force(seed):
+    rng = random.Random(seed)
+    latitudes, longitudes = random_points(rng, 400)
+    index = SpatialIndex(latitudes, longitudes)
+    for _ in range(50):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        k = rng.randint(1, 12)
+        expected = brute_force(latitudes, longitudes, lat, lon)[:k]
+        found = index.nearest(lat, lon, k)
+        assert [distance for _, distance in found] == pytest.approx([distance for distance, _ in expected],
+                                                                     abs=1e-6)
+        assert len(found) == k
+
+@pytest.mark.parametrize("seed", range(4))
+def test_within_radius_matches_brute_force(seed):
+    rng = random.Random(100 + seed)
+    latitudes, longitudes = random_points(rng, 400)
+    index = SpatialIndex(latitudes, longitudes)
+    for _ in range(50):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        radius_km = rng.choice([50.0, 500.0, 2500.0, 20000.0])
+        expected = {row_id for distance, row_id in brute_force(latitudes, longitudes, lat, lon)
+                    if distance <= radius_km}
+        found = index.within_radius(lat, lon, radius_km)
+        assert {row_id for row_id, _ in found} == expected
+        assert [distance for _, distance in found] == sorted(distance for _, distance in found)
+        for row_id, distance in found:
+            assert distance == pytest.approx(haversine_km(lat, lon, latitudes[row_id], longitudes[row_id]), abs=1e-6)
+
+def test_empty_and_zero_queries():
+    index = SpatialIndex(array("d"), array("d"))
+    assert index.nearest(0.0, 0.0, 3) == []
+    assert index.within_radius(0.0, 0.0, 100.0) == []
+    index = SpatialIndex(array("d", [51.5]), array("d", [-0.1]))
+    assert index.nearest(51.5, -0.1, 0) == []
+    assert index.nearest(51.5, -0.1, 5) == [(0, pytest.approx(0.0, abs=1e-6))]
@@ -0,0 +1,50 @@
+import asyncio
+
+from backend.algorithm import AsyncRateLimiter, RouteOptimizer
+from backend.circuit_breaker import CircuitBreaker
+from backend.price_cache import MemoryPriceCache, PriceKey
+from backend.quota import CallPriority
+
+KEY = PriceKey("LHR", "CDG", "2026-12-01", 1, 0, 0, "GBP")
+
+# One failure opens the circuit; moving the opening back a full timeout makes the next
+# call the half-open probe.
+def expired_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+    breaker.opened_at -= 60.0
+    return breaker
+
+def test_probe_in_flight_counts_as_open():
+    breaker = expired_breaker()
+    assert not breaker.is_open()
+    with breaker.call() as allowed:
+        assert allowed
+        assert breaker.is_open()
+    assert not breaker.is_open()
+
+def test_fail_fast_while_probing_spends_no_token():
+    breaker = expired_breaker()
+    limiter = AsyncRateLimiter(rate=1.0, burst=5)
+    optimizer = RouteOptimizer(price_cache=MemoryPriceCache(), circuit_breaker=breaker, async_rate_limiter=limiter)
+    with breaker.call() as allowed:
+        assert allowed
+        price = asyncio.run(optimizer._fetch_flight_price_async(KEY, CallPriority()))
+    assert price == 0.0
+    assert limiter.available() == 5
+
+# A caller that passed the cheap check but lost the probe to another caller while it
+# waited for its token gives the token back.
+def test_refused_admission_refunds_the_token():
+    breaker = expired_breaker()
+    limiter = AsyncRateLimiter(rate=1.0, burst=5)
+    acquire = limiter.acquire
+
+    async def acquire_while_another_probes(priority):
+        await acquire(priority)
+        breaker._admit()
+
+    limiter.acquire = acquire_while_another_probes
+    optimizer = RouteOptimizer(price_cache=MemoryPriceCache(), circuit_breaker=breaker, async_rate_limiter=limiter)
+    assert asyncio.run(optimizer._fetch_flight_price_async(KEY, CallPriority())) == 0.0
+    assert limiter.available() == 5
@@ -0,0 +1,118 @@
+import asyncio
+import itertools
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.algorithm import DistancePriceBound, RouteOptimizer
+from backend.price_cache import MemoryPriceCache
+from conftest import fake_price
+
+CITIES = ["Paris", "Rome", "Berlin", "Madrid", "Vienna", "Prague", "Amsterdam"]
+START_DATE = "2026-12-01"
+
+pytestmark = pytest.mark.usefixtures("fake_api")
+
+# A fresh cache per optimizer keeps the engines from seeing each other's prices, and a
+# zero distance bound is admissible for any fare, so branch and bound stays exact.
+def make_optimizer() -> RouteOptimizer:
+    return RouteOptimizer(max_workers=2, price_cache=MemoryPriceCache(),
+                          price_bound=DistancePriceBound(per_km=0.0, calibrate=False))
+
+def random_trip(rng: random.Random, size: int):
+    middle = [{"name": name, "days": rng.randint(1, 4)} for name in rng.sample(CITIES, size)]
+    end = datetime.strptime(START_DATE, "%Y-%m-%d") + timedelta(days=sum(city["days"] for city in middle))
+    return middle, end.strftime("%Y-%m-%d")
+
+def costs(routes):
+    return [round(route["total_cost"], 6) for route in routes]
+
+@pytest.mark.parametrize("size", range(0, 6))
+@pytest.mark.parametrize("engine", ["dp", "bnb"])
+def test_engine_matches_permutations(engine, size):
+    rng = random.Random(size)
+    for _ in range(3):
+        middle, end_date = random_trip(rng, size)
+        expected = make_optimizer().find_optimal_routes("London", "London", middle, START_DATE, end_date,
+                                                        num_results=5, engine="permutations")
+        routes = make_optimizer().find_optimal_routes("London", "London", middle, START_DATE, end_date,
+                                                      num_results=5, engine=engine)
+        assert costs(routes) == costs(sorted(expected, key=lambda route: route["total_cost"])[:5])
+        for route in routes:
+            assert route["total_cost"] == pytest.approx(sum(route["individual_prices"]))
+
+@pytest.mark.parametrize("engine", ["dp", "bnb"])
+def test_async_engine_matches_sync(engine):
+    middle, end_date = random_trip(random.Random(7), 5)
+    expected = make_optimizer().find_optimal_routes("London", "Rome", middle, START_DATE, end_date,
+                                                    num_results=3, engine="permutations")
+    routes = asyncio.run(make_optimizer().find_optimal_routes_async("London", "Rome", middle, START_DATE,
+                                                                     end_date, num_results=3, engine=engine))
+    assert costs(routes) == costs(sorted(expected, key=lambda route: route["total_cost"])[:3])
+
+# Every order of the cities and every stay length in each flex window that still fits
+# the trip, priced leg by leg.
+def brute_force_flex(optimizer: RouteOptimizer, middle, horizon: int, date_flex: int):
+    start = datetime.strptime(START_DATE, "%Y-%m-%d")
+    totals = []
+    for order in itertools.permutations(range(len(middle))):
+        windows = [range(max(1, middle[i]["days"] - date_flex), middle[i]["days"] + date_flex + 1) for i in order]
+        for stays in itertools.product(*windows):
+            if sum(stays) > horizon:
+                continue
+            route = ["London"] + [middle[i]["name"] for i in order] + ["London"]
+            offset, total = 0, 0.0
+            for position in range(len(route) - 1):
+                offset += stays[position - 1] if position else 0
+                key = optimizer._price_key(route[position], route[position + 1],
+                                           (start + timedelta(days=offset)).strftime("%Y-%m-%d"))
+                price = fake_price(key.from_iata, key.to_iata, key.date)
+                if price <= 0:
+                    break
+                total += price
+            else:
+                totals.append(round(total, 6))
+    return sorted(totals)
+
+@pytest.mark.parametrize("seed", range(6))
+def test_flex_matches_brute_force(seed):
+    rng = random.Random(seed)
+    middle, _ = random_trip(rng, rng.randint(1, 4))
+    date_flex = rng.randint(1, 2)
+    horizon = sum(city["days"] for city in middle) + rng.randint(-1, 3)
+    end_date = (datetime.strptime(START_DATE, "%Y-%m-%d") + timedelta(days=horizon)).strftime("%Y-%m-%d")
+    optimizer = make_optimizer()
+    routes = optimizer.find_optimal_routes("London", "London", middle, START_DATE, end_date,
+                                           num_results=4, date_flex=date_flex)
+    assert costs(routes) == brute_force_flex(optimizer, middle, horizon, date_flex)[:4]
+    for route in routes:
+        assert sum(route["days_per_city"]) <= horizon
+
+def test_deadline_stops_before_every_leg_is_priced(slow_api):
+    slow_api(0.05)
+    middle = [{"name": name, "days": 2} for name in CITIES[:6]]
+    optimizer = make_optimizer()
+    routes = asyncio.run(optimizer.find_optimal_routes_async("London", "London", middle, START_DATE, "2026-12-15",
+                                                             num_results=3, deadline_ms=300))
+    stats = optimizer.search_stats
+    assert stats["engine"] == "anytime"
+    assert stats["legs_priced"] < stats["legs_planned"]
+    assert stats["proven_optimal"] is False
+    assert len(routes) <= 3
+
+def test_deadline_with_date_flex_is_rejected():
+    with pytest.raises(ValueError):
+        make_optimizer().find_optimal_routes("London", "London", [{"name": "Paris", "days": 2}], START_DATE,
+                                             "2026-12-05", date_flex=1, deadline_ms=500)
+
+def test_bnb_is_only_proven_optimal_with_an_admissible_bound():
+    middle, end_date = random_trip(random.Random(3), 4)
+    optimizer = make_optimizer()
+    optimizer.find_optimal_routes("London", "London", middle, START_DATE, end_date, engine="bnb")
+    assert optimizer.search_stats["proven_optimal"] is True
+
+    fitted = DistancePriceBound.calibrate([(distance, 20 + 0.05 * distance) for distance in range(100, 3000, 50)])
+    optimizer = RouteOptimizer(max_workers=2, price_cache=MemoryPriceCache(), price_bound=fitted)
+    optimizer.find_optimal_routes("London", "London", middle, START_DATE, end_date, engine="bnb")
+    assert optimizer.search_stats["proven_optimal"] is False
@@ -0,0 +1,38 @@
+import pytest
+
+from backend.iata_lookup import iata_lookup
+
+@pytest.mark.parametrize("text, iata, matched_by", [
+    ("LHR", "LHR", "iata"),
+    ("London", "LHR", "city"),
+    ("  paris ", "CDG", "city"),
+    ("LON", "LON", "code"),
+    ("PAR", "PAR", "code"),
+    ("Lond", "LHR", "search"),
+    ("Xyzzy", None, "unresolved"),
+])
+def test_resolve(text, iata, matched_by):
+    resolution = iata_lookup.resolve(text)
+    assert (resolution.iata, resolution.matched_by) == (iata, matched_by)
+
+def test_only_exact_matches_are_exact():
+    assert iata_lookup.resolve("London").exact
+    assert not iata_lookup.resolve("Lond").exact
+    assert not iata_lookup.resolve("LON").exact
+
+@pytest.mark.parametrize("query, city, first", [
+    ("par", "Paris", "CDG"),
+    ("lon", "London", "LHR"),
+    ("new", "New York", "JFK"),
+    ("ber", "Berlin", None),
+])
+def test_search_ranks_major_cities_first(query, city, first):
+    suggestions = iata_lookup.search_airports(query)
+    assert suggestions[0].startswith(f"{city} (")
+    if first:
+        assert suggestions[0].startswith(f"{city} ({first})")
+
+def test_search_puts_same_named_places_after_the_city():
+    suggestions = iata_lookup.search_airports("london")
+    places = [suggestion.split(" - ")[0] for suggestion in suggestions]
+    assert places.index("London (YXU)") > places.index("London (LGW)")
@@ -0,0 +1,32 @@
+import pytest
+
+import main
+
+TRIP = {"start_city": "London", "end_city": "London",
+        "middle_cities": [{"name": name, "days": 2} for name in ["Paris", "Rome", "Berlin", "Madrid", "Vienna", "Prague"]],
+        "total_days": 14, "start_date": "2026-12-01", "end_date": "2026-12-15"}
+
+def test_unproven_deadline_answer_is_not_cached(client, slow_api):
+    slow_api(0.05)
+    response = client.post("/optimize", json=dict(TRIP, deadline_ms=300))
+    assert response.status_code == 200
+    assert response.json()["proven_optimal"] is False
+    assert response.json()["search_stats"]["engine"] == "anytime"
+    assert "X-Result-Cache" not in response.headers
+    assert len(main.result_cache.entries) == 0
+
+def test_deadline_with_date_flex_is_rejected(client, fake_api):
+    response = client.post("/optimize", json=dict(TRIP, deadline_ms=500, date_flex=1))
+    assert response.status_code == 400
+
+def test_iata_is_not_found_for_guesses(client):
+    assert client.get("/iata", params={"city": "London"}).json()["iata"] == "LHR"
+    assert client.get("/iata", params={"city": "Lond"}).status_code == 404
+    assert client.get("/iata", params={"city": "LON"}).status_code == 404
+
+@pytest.mark.parametrize("override", [{"engine": "bnb"}, {"deadline_ms": 500}])
+def test_batch_rejects_per_trip_search_options(client, fake_api, override):
+    response = client.post("/optimize/batch", json={"trips": [TRIP, dict(TRIP, **override)]})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("trips[1]:")
+    assert client.post("/optimize/batch", json={"trips": [TRIP]}).json()["results"][0]["status"] == "success"
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from backend.quota import CallPriority, SharedTokenBucket
+
+def counting_bucket(tmp_path, **options):
+    bucket = SharedTokenBucket(path=str(tmp_path / "quota.bin"), **options)
+    bucket.takes = 0
+    take = bucket._take
+
+    def counted(priority):
+        bucket.takes += 1
+        return take(priority)
+
+    bucket._take = counted
+    return bucket
+
+def test_queued_waiters_do_not_poll_the_file(tmp_path):
+    bucket = counting_bucket(tmp_path, rate=20.0, burst=10)
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(bucket.acquire("batch")) for _ in range(500)]
+        await asyncio.sleep(1.0)
+        granted = sum(waiter.done() for waiter in waiters)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return granted
+
+    granted = asyncio.run(scenario())
+    assert granted >= 10
+    assert bucket.takes <= 3 * granted + 10
+    assert all(not queue for queue in bucket.queues.values())
+
+def test_raised_waiter_skips_the_reserve(tmp_path):
+    bucket = SharedTokenBucket(path=str(tmp_path / "quota.bin"), rate=1.0, burst=4)
+
+    async def scenario():
+        for _ in range(3):
+            await bucket.acquire("interactive")
+        priority = CallPriority("prefetch")
+        waiter = asyncio.ensure_future(bucket.acquire(priority))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        started = time.monotonic()
+        priority.join(CallPriority("interactive"))
+        await waiter
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 0.5
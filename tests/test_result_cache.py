@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+import main
+from backend.result_cache import ResultCache, etag_matches, trip_key
+
+TRIP = {"start_city": "London", "end_city": "London",
+        "middle_cities": [{"name": "Paris", "days": 2}, {"name": "Rome", "days": 3}, {"name": "Berlin", "days": 2}],
+        "total_days": 7, "start_date": "2026-12-01", "end_date": "2026-12-08"}
+
+pytestmark = pytest.mark.usefixtures("fake_api")
+
+def key_for(middle_cities, **overrides):
+    trip = dict(TRIP, middle_cities=middle_cities, **overrides)
+    return trip_key(trip["start_city"], trip["end_city"], trip["middle_cities"], trip["start_date"],
+                    trip["end_date"], 1, 0, 0, "dp", 0, main.iata_lookup.get_iata_code)
+
+def max_age(response) -> int:
+    return int(response.headers["Cache-Control"].split("max-age=")[1])
+
+def test_key_ignores_city_order_and_spelling():
+    reordered = [{"name": " rome", "days": 3}, {"name": "Berlin", "days": 2}, {"name": "PARIS ", "days": 2}]
+    assert key_for(reordered) == key_for(TRIP["middle_cities"])
+    assert key_for([dict(city, days=1) for city in reordered]) != key_for(TRIP["middle_cities"])
+
+def test_entries_expire_and_evict_oldest():
+    cache = ResultCache(max_entries=2)
+    first, second, third = (key_for(TRIP["middle_cities"], start_date=day)
+                            for day in ("2026-12-01", "2026-12-02", "2026-12-03"))
+    cache.set(first, {"routes": 1})
+    cache.set(second, {"routes": 2}, ttl=0)
+    assert cache.get(second) is None
+    cache.set(second, {"routes": 2})
+    cache.get(first)
+    cache.set(third, {"routes": 3})
+    assert cache.get(second) is None
+    assert cache.get(first).body == b'{"routes":1}'
+
+def test_etag_matching():
+    etag = '"abc"'
+    assert etag_matches('"x", "abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"abd"', etag)
+
+def test_repeat_request_is_served_from_cache_with_etag(client):
+    first = client.post("/optimize", json=TRIP)
+    assert first.status_code == 200
+    assert first.headers["X-Result-Cache"] == "miss"
+
+    reordered = dict(TRIP, middle_cities=list(reversed(TRIP["middle_cities"])))
+    second = client.post("/optimize", json=reordered)
+    assert second.headers["X-Result-Cache"] == "hit"
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert second.content == first.content
+
+    revalidated = client.post("/optimize", json=TRIP, headers={"If-None-Match": first.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert main.result_cache.stats()["not_modified"] == 1
+
+# The result may only be cached for as long as the shortest-lived price behind it.
+def test_ttl_is_capped_by_the_shortest_lived_price(client):
+    trip = dict(TRIP, middle_cities=[{"name": "Paris", "days": 2}], end_date="2026-12-03")
+    optimizer = main.build_optimizer(1, 0, 0)
+    main.price_cache.set(optimizer._price_key("London", "Paris", "2026-12-01"), 80.0, ttl=120)
+    main.price_cache.set(optimizer._price_key("Paris", "London", "2026-12-03"), 90.0)
+
+    response = client.post("/optimize", json=trip)
+    assert response.json()["routes"][0]["total_cost"] == 170.0
+    assert 100 < max_age(response) <= 120
+    assert main.result_cache.entries[key_for(trip["middle_cities"], end_date="2026-12-03")].expires_at \
+        == pytest.approx(time.time() + 120, abs=5)
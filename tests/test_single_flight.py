@@ -0,0 +1,41 @@
+import asyncio
+
+from backend.single_flight import AsyncSingleFlight
+
+def test_caller_after_last_waiter_left_starts_a_fresh_call():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                await asyncio.sleep(0.01)
+                raise
+            return len(calls)
+
+        first = asyncio.ensure_future(flights.do("leg", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert await flights.do("leg", fetch) == 2
+
+    asyncio.run(scenario())
+
+def test_joiners_share_one_call():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 42.0
+
+        results = await asyncio.gather(*(flights.do("leg", fetch) for _ in range(5)))
+        assert results == [42.0] * 5 and len(calls) == 1
+        assert flights.stats() == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+
+    asyncio.run(scenario())